@@ -0,0 +1,400 @@
+#! /usr/bin/env python3
+"""
+Benchmarks of the snake games. None of them open a window.
+
+imports - times the import of the modules the training entry points load, in
+    a fresh interpreter with -X importtime, and fails if one is over budget.
+    Under the spawn start method every pool worker pays these again.
+snake - Snake.move, Snake.hitSelf and Food.relocate with tails of increasing length
+encode - QTable.encodeState with tails of increasing length
+qtable - QTable.getRow, updateQValue and chooseAction with more and more states in the table
+blocks - laying out the redirection blocks of complex_snake.Game
+episodes - full training episodes per second of qsnake.QGame and qcomplex_snake.QGame
+scaling - a fixed, seeded qsnake.train() sweep with 1, 2, 4, ... workers: wall
+    time, steps, steps/sec and parallel efficiency
+
+Usage:
+    python -m benchmark SUITE [SUITE ...] [-repeats N] [-workers N] [-out FILE] [-baseline FILE [-tolerance T]]
+
+With -out the results are written to FILE as JSON, with the commit they were
+measured on, so runs of different commits can be compared. With -baseline the
+scaling suite fails if it is slower than in a file written before.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+# Budgets for the cumulative import time of the modules, in milliseconds.
+# pygame (Block is a pygame.Rect) and pandas (QTable is a DataFrame) make up most of it.
+IMPORT_BUDGETS = {"constant": 10, "snake": 400, "qsnake": 750, "qcomplex_snake": 800}
+
+
+def importTime(module, repeats=5):
+    """
+    Measures the time it takes to import a module in a new interpreter
+
+    Arguments:
+    module - name of the module
+    repeats - number of interpreters to start, the fastest one counts
+
+    returns the cumulative import time in milliseconds
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, SDL_VIDEODRIVER="dummy")
+    fastest = None
+    for repeat in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, cwd=directory, env=environment)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+        # Lines look like "import time: self [us] | cumulative | imported package",
+        # the package is indented by how deeply it was imported
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2] == " " + module:
+                milliseconds = int(fields[1]) / 1000
+                fastest = milliseconds if fastest is None else min(fastest, milliseconds)
+    return fastest
+
+
+def benchmarkImports(budgets=IMPORT_BUDGETS, repeats=5):
+    """
+    Times the import of every module with a budget
+
+    Arguments:
+    budgets - dictionary of module name to budget in milliseconds
+    repeats - number of imports timed per module
+
+    returns a list of dictionaries, one per module
+    """
+    results = []
+    for module, budget in budgets.items():
+        milliseconds = importTime(module, repeats)
+        results.append({'module': module, 'ms': milliseconds, 'budget_ms': budget, 'ok': milliseconds <= budget})
+        print(f"Module: {module}; Import: {milliseconds:.1f} ms; Budget: {budget} ms; "
+            f"{'ok' if milliseconds <= budget else 'OVER BUDGET'}")
+    return results
+
+
+def timeCall(function, number):
+    """
+    Times a function that takes no arguments
+
+    Arguments:
+    function - the function to call
+    number - number of calls per round, the fastest of three rounds counts
+
+    returns the time of a call in microseconds
+    """
+    return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def cycleCells(columns, rows):
+    """
+    Returns a cycle through every cell of a board with an even number of
+    columns: down and up the columns below the top row, then back along the
+    top row. A snake following it never runs into its own tail.
+    """
+    if columns % 2:
+        raise ValueError("The board needs an even number of columns")
+    cells = []
+    for column in range(columns):
+        ordered = range(1, rows) if column % 2 == 0 else range(rows - 1, 0, -1)
+        cells += [(column, row) for row in ordered]
+    return cells + [(column, 0) for column in range(columns - 1, -1, -1)]
+
+
+def placeSnake(game, length):
+    """
+    Lays a snake with a tail of the given length along cycleCells() and moves
+    the food off the board, so the snake can move forever without eating
+
+    returns the Directions that take the head around the cycle, starting with its next move
+    """
+    import snake
+    cells = cycleCells(game.gridWidth, game.gridHeight)
+    positions = [(game.leftBoundry + column * game.size, row * game.size) for column, row in cells]
+    game.snake.tail = [snake.Block(game.size, x, y) for x, y in positions[:length]]
+    game.snake.countOccupancy()
+    game.snake.x, game.snake.y = positions[length]
+    game.food.x, game.food.y = -game.size, -game.size
+
+    turns = [snake.Direction([next_cell[0] - cell[0], next_cell[1] - cell[1]])
+        for cell, next_cell in zip(cells, cells[1:] + cells[:1])]
+    return turns[length:] + turns[:length]
+
+
+def benchmarkSnake(tail_lengths=(1, 50, 200), repeats=2000):
+    """
+    Times the snake's moves, the check of its head against its tail and the
+    placement of the food with tails of increasing length
+
+    Arguments:
+    tail_lengths - lengths of the tails to test
+    repeats - number of calls timed per round
+
+    returns a list of dictionaries, one per length
+    """
+    import itertools
+    import snake
+
+    results = []
+    for length in tail_lengths:
+        game = snake.Game(screen=False, seed=0)
+        snake_obj = game.snake
+        turns = itertools.cycle(placeSnake(game, length))
+
+        def move():
+            snake_obj.changeDirection(next(turns), avoidFlip=False)
+            snake_obj.move()
+
+        result = {'tail': length, 'move_us': timeCall(move, repeats),
+            'hitSelf_us': timeCall(lambda: snake_obj.hitSelf(snake_obj.x, snake_obj.y), repeats),
+            'relocate_us': timeCall(game.food.relocate, repeats)}
+        if game.done or len(snake_obj.tail) != length:
+            raise RuntimeError(f"The snake left the cycle with a tail of {length}")
+        results.append(result)
+        print(f"Tail: {length}; Move: {result['move_us']:.2f} us; Hit self: {result['hitSelf_us']:.2f} us; "
+            f"Relocate food: {result['relocate_us']:.2f} us")
+    return results
+
+
+def benchmarkEncode(tail_lengths=(1, 50, 200), repeats=2000):
+    """
+    Times encoding a state with the encoder of the QTable (see qsnake.benchmarkEncoder())
+
+    returns a list of dictionaries, one per length
+    """
+    import qsnake
+    return qsnake.benchmarkEncoder(tail_lengths, repeats, [qsnake.QTable.Encoder])
+
+
+def benchmarkQTable(fills=(16, 256, 4096), repeats=500):
+    """
+    Times looking up and updating rows of the QTable, and choosing an action,
+    as the table fills up with states
+
+    Arguments:
+    fills - numbers of states in the table, up to 4096 (every 12 bit state)
+    repeats - number of calls timed per round
+
+    returns a list of dictionaries, one per fill
+    """
+    import qsnake
+
+    game = qsnake.QGame(training=True, seed=0)
+    table = game.qTable
+    states = [format(bits, '012b') for bits in range(4096)]
+    results = []
+    for fill in fills:
+        for state in states[:fill]:
+            table.getRow(state, game.snake)
+        state, next_state = states[0], states[fill - 1]
+        game.current_state = state
+
+        result = {'states': len(table),
+            'getRow_us': timeCall(lambda: table.getRow(next_state, game.snake), repeats),
+            'updateQValue_us': timeCall(lambda: table.updateQValue(state, next_state, "UP", .1), repeats),
+            'chooseAction_us': timeCall(table.chooseAction, repeats)}
+        results.append(result)
+        print(f"States: {result['states']}; Get row: {result['getRow_us']:.1f} us; "
+            f"Update Q value: {result['updateQValue_us']:.1f} us; Choose action: {result['chooseAction_us']:.1f} us")
+    return results
+
+
+def benchmarkBlocks(counts=(10, 60), repeats=20):
+    """
+    Times laying out new redirection blocks on the board of complex_snake.Game
+
+    Arguments:
+    counts - numbers of blocks to test
+    repeats - number of layouts timed per round
+
+    returns a list of dictionaries, one per count
+    """
+    import complex_snake
+
+    results = []
+    for count in counts:
+        game = complex_snake.Game(screen=False, seed=0, blocks=count)
+        result = {'blocks': count, 'ms': timeCall(game.newBoard, repeats) / 1000}
+        results.append(result)
+        print(f"Blocks: {count}; New board: {result['ms']:.2f} ms")
+    return results
+
+
+def benchmarkEpisodes(episodes=20, seed=0):
+    """
+    Times training episodes of the Q-Learning games, the way runReplication() plays them
+
+    Arguments:
+    episodes - number of episodes per game
+    seed - seed of the games
+
+    returns a list of dictionaries, one per game
+    """
+    import qsnake
+    import qcomplex_snake
+
+    results = []
+    for game_type in (qsnake.QGame, qcomplex_snake.QGame):
+        game = game_type(training=True, watchTraining=False, seed=seed)
+        game.reset(newQ=True, learning_rate=.9)
+        moves = game.snake.moves
+        start = time.perf_counter()
+        for episode in range(episodes):
+            game.play()
+            game.reset()
+        seconds = time.perf_counter() - start
+        steps = game.snake.moves - moves
+
+        result = {'game': f"{game_type.__module__}.{game_type.__name__}", 'episodes': episodes, 'steps': steps,
+            'episodes_per_second': episodes / seconds, 'steps_per_second': steps / seconds}
+        results.append(result)
+        print(f"Game: {result['game']}; Episodes/sec: {result['episodes_per_second']:.1f}; "
+            f"Steps/sec: {result['steps_per_second']:.0f}")
+    return results
+
+
+def workerCounts(most):
+    """Returns 1, 2, 4, ... up to and including most"""
+    counts = []
+    count = 1
+    while count < most:
+        counts.append(count)
+        count *= 2
+    return counts + [most]
+
+
+def benchmarkScaling(most_workers=None, tasks=64, trials=5, replications=1, seed=0):
+    """
+    Runs the same seeded qsnake.train() sweep with 1, 2, 4, ... workers. Every run
+    plays the same games, so the steps are the same and only the time changes.
+
+    Arguments:
+    most_workers - largest number of workers, one per core by default
+    tasks - number of trial counts in the sweep, each is a task of the pool
+    trials - every trial count of the sweep
+    replications - replications of every trial count
+    seed - seed of the sweep
+
+    returns a list of dictionaries, one per number of workers. The efficiency is
+    the speed up over one worker divided by the number of workers.
+    """
+    import contextlib
+    import io
+    import qsnake
+
+    results = []
+    for workers in workerCounts(most_workers or os.cpu_count()):
+        start = time.perf_counter()
+        # train() prints (and scipy warns about) every record
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            telemetry = qsnake.train(replications, qsnake.QGame, [trials] * tasks, seed=seed, processes=workers)
+        seconds = time.perf_counter() - start
+        steps = sum(task['steps'] for task in telemetry)
+
+        result = {'workers': workers, 'seconds': seconds, 'steps': steps, 'steps_per_second': steps / seconds}
+        result['efficiency'] = result['steps_per_second'] / (results[0]['steps_per_second'] * workers) if results else 1.0
+        if results and steps != results[0]['steps']:
+            raise RuntimeError(f"The sweep played {steps} steps with {workers} workers but {results[0]['steps']} with 1")
+        results.append(result)
+        print(f"Workers: {workers}; Wall time: {seconds:.2f} s; Steps: {steps}; "
+            f"Steps/sec: {result['steps_per_second']:.0f}; Efficiency: {result['efficiency']:.0%}")
+    return results
+
+
+def scalingRegressions(results, baseline, tolerance=.1):
+    """
+    Compares the results of benchmarkScaling() with the ones saved in a baseline
+
+    Arguments:
+    results - list of dictionaries from benchmarkScaling()
+    baseline - file written by writeResults() with a scaling suite
+    tolerance - fraction of the baseline's steps/sec that can be lost before it counts
+
+    returns a list of the results that are slower than the baseline, each with the baseline's steps/sec
+    """
+    with open(baseline) as in_file:
+        saved = {result['workers']: result for result in json.load(in_file)['results'].get("scaling", [])}
+
+    regressions = []
+    for result in results:
+        before = saved.get(result['workers'])
+        if before and result['steps_per_second'] < before['steps_per_second'] * (1 - tolerance):
+            regressions.append(dict(result, baseline_steps_per_second=before['steps_per_second']))
+            print(f"REGRESSION Workers: {result['workers']}; Steps/sec: {result['steps_per_second']:.0f}; "
+                f"Baseline: {before['steps_per_second']:.0f}")
+    return regressions
+
+
+def gitCommit():
+    """Returns the commit the benchmarks are run on, None outside of a git repository"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=directory)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def writeResults(file_name, results):
+    """
+    Writes the results of the suites to a JSON file, with what they were measured on
+
+    Arguments:
+    file_name - the file to write
+    results - dictionary of suite name to its list of results
+    """
+    with open(file_name, "w") as out_file:
+        json.dump({'commit': gitCommit(), 'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'results': results}, out_file, indent=4)
+
+
+SUITES = ["imports", "snake", "encode", "qtable", "blocks", "episodes", "scaling"]
+
+
+def parseArgs():
+    """
+    Parses the command line arguments.
+
+    Returns them as a Namespace object
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the snake games.")
+    parser.add_argument('suites', nargs='+', choices=SUITES + ["all"], metavar="suite",
+        help=f"One or more of {', '.join(SUITES)} or all")
+    parser.add_argument('-repeats', '-r', type=int, default=5, help="Interpreters started per module by imports")
+    parser.add_argument('-workers', '-w', type=int, help="Most workers of scaling, one per core by default")
+    parser.add_argument('-out', '-o', help="JSON file to write the results to")
+    parser.add_argument('-baseline', '-b', help="JSON file of an earlier run to compare scaling with")
+    parser.add_argument('-tolerance', '-t', type=float, default=.1,
+        help="Fraction of the baseline's steps/sec scaling can lose before it fails")
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    suites = {"imports": lambda: benchmarkImports(repeats=args.repeats), "snake": benchmarkSnake,
+        "encode": benchmarkEncode, "qtable": benchmarkQTable, "blocks": benchmarkBlocks,
+        "episodes": benchmarkEpisodes, "scaling": lambda: benchmarkScaling(args.workers)}
+
+    results = {}
+    for suite in (SUITES if "all" in args.suites else args.suites):
+        print(f"Suite: {suite}")
+        results[suite] = suites[suite]()
+
+    if args.out:
+        writeResults(args.out, results)
+    over_budget = not all(result['ok'] for result in results.get("imports", []))
+    regressions = scalingRegressions(results["scaling"], args.baseline, args.tolerance) \
+        if args.baseline and "scaling" in results else []
+    sys.exit(1 if over_budget or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
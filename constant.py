@@ -1,6 +1,4 @@
-from pandas import DataFrame
 COLUMNS = ["UP", "DOWN", "LEFT", "RIGHT"]
-INITIAL_DATAFRAME = DataFrame([[0, 0, 0, 0]], columns=COLUMNS)
 BLOCK_SIZE = 40
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 600
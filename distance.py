@@ -0,0 +1,152 @@
+#! /usr/bin/env python3
+"""
+Obstacle aware distances to the food.
+
+A distance field holds, for every cell of the board, the number of moves
+needed to reach the food going around walls and redirection blocks (but not
+the snake's tail, which changes every step). One breadth first search is run
+per (layout, food position) when the food is placed, after that looking up the
+distance from the head is O(1).
+
+Usage:
+    python distance.py --benchmark
+"""
+import argparse
+import os
+import time
+from collections import deque
+import numpy as np
+
+
+class DistanceFields():
+    """
+    Cache of distance fields for the obstacle layout of a game
+
+    Public Methods:
+    field(x, y)
+    clear()
+
+    Instance Variables:
+    game - the game whose obstacleMask is searched
+    max_fields - number of fields kept before the oldest are dropped
+    """
+
+    def __init__(self, game, max_fields=1024):
+        self.game = game
+        self.max_fields = max_fields
+        self.fields = {}
+
+    def field(self, x, y):
+        """
+        Returns the distance field to the cell at the given position as a
+        read only (gridHeight, gridWidth) numpy array. Unreachable cells are -1.
+        """
+        index = self.game.cellIndex(x, y)
+        field = self.fields.get(index)
+        if field is None:
+            if len(self.fields) >= self.max_fields:
+                del self.fields[next(iter(self.fields))]
+            field = breadthFirstSearch(self.game.obstacleMask, self.game.gridWidth + 2, index)
+            field = field.reshape(self.game.gridHeight + 2, self.game.gridWidth + 2)[1:-1, 1:-1]
+            field.flags.writeable = False
+            self.fields[index] = field
+        return field
+
+    def clear(self):
+        """Drops every cached field, needed when the layout changes"""
+        self.fields.clear()
+
+
+def breadthFirstSearch(mask, stride, start):
+    """
+    Computes the number of moves from every cell of a padded grid to the start cell
+
+    Arguments:
+    mask - bytearray of the padded grid, non zero cells are blocked
+    stride - width of a row of the padded grid
+    start - index of the cell to search from
+
+    returns a flat numpy int32 array, -1 for blocked or unreachable cells
+    """
+    distances = [-1] * len(mask)
+    if mask[start]:
+        return np.array(distances, dtype=np.int32)
+
+    distances[start] = 0
+    offsets = (-stride, stride, -1, 1)
+    queue = deque([start])
+    while queue:
+        cell = queue.popleft()
+        next_distance = distances[cell] + 1
+        for offset in offsets:
+            neighbour = cell + offset
+            # The border of the padded grid is blocked so neighbour never leaves the grid
+            if distances[neighbour] < 0 and not mask[neighbour]:
+                distances[neighbour] = next_distance
+                queue.append(neighbour)
+
+    return np.array(distances, dtype=np.int32)
+
+
+def benchmark(boards=((20, 15), (50, 50), (100, 100), (200, 200)), steps=20000, seed=0):
+    """
+    Compares the time of computing a distance field with the time of a step of
+    the snake on boards of increasing size
+
+    Arguments:
+    boards - list of (columns, rows) to test
+    steps - number of steps to time on each board
+    seed - seed of the games
+
+    returns a list of dictionaries, one per board
+    """
+    import snake
+    import qsnake
+
+    results = []
+    for columns, rows in boards:
+        size = 40
+        game = snake.Game(size, windowHeight=rows * size, windowWidth=columns * size,
+            gameHeight=rows * size, gameWidth=columns * size, screen=False, seed=seed)
+        game.snake = qsnake.Snake(game)
+        game.watchTraining = False
+
+        cells = [(game.leftBoundry + column * size, row * size)
+            for column in range(columns) for row in range(rows)]
+        samples = cells[::max(1, len(cells) // 50)]
+        start = time.perf_counter()
+        for x, y in samples:
+            game.distanceFields.clear()
+            game.distanceFields.field(x, y)
+        field_seconds = (time.perf_counter() - start) / len(samples)
+
+        directions = [snake.Direction.UP, snake.Direction.LEFT, snake.Direction.DOWN, snake.Direction.RIGHT]
+        start = time.perf_counter()
+        for step in range(steps):
+            if game.done:
+                game.restart()
+            game.snake.changeDirection(game.random.choice(directions))
+            game.snake.move()
+        step_seconds = (time.perf_counter() - start) / steps
+
+        result = {'columns': columns, 'rows': rows, 'field_ms': field_seconds * 1000,
+            'step_us': step_seconds * 1e6, 'steps_per_field': field_seconds / step_seconds}
+        results.append(result)
+        print(f"Board: {columns}x{rows}; Distance field: {result['field_ms']:.2f} ms; "
+            f"Step: {result['step_us']:.1f} us; One field costs {result['steps_per_field']:.1f} steps")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Obstacle aware distance fields.")
+    parser.add_argument('--benchmark', action="store_true")
+    args = parser.parse_args()
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    if args.benchmark:
+        benchmark()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 
 import json
 from scipy import stats
-from scipy.stats import describe, sem, t, linregress
+from scipy.stats import t, linregress
 import matplotlib.pyplot as plt
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import normalize
@@ -10,33 +10,12 @@ from sklearn.metrics import r2_score
 from scipy.optimize import curve_fit
 import numpy as np
 import math
+import multiprocessing
+import os
 import sys
+import time
 import argparse
 
-def undo(array):
-    """
-    Convert string of numebrs in psudo list format
-    to list of ints
-
-    Arguments:
-    array - the string to convert
-
-    returns a list of integers
-    """
-    skip = False
-    l = []
-    for i, c in enumerate(array):
-        if skip:
-            skip = False
-            continue
-        if c != ' ':
-            if i + 1 < len(array) - 1 and array[i+1] != ' ':
-                l.append(int(c + array[i+1]))
-                skip = True
-            else:
-               l.append(int(c)) 
-    return l
-
 def find_training_data(file_name, count=0):
     """
     Using the given file_name, will find specified training data.
@@ -70,6 +49,97 @@ def find_training_data(file_name, count=0):
                 out += line
     return json.loads(out)
 
+def find_database_run(results, args):
+    """
+    Finds the run of the command line arguments in a SQLite results store, the
+    latest run of the game if none is given
+
+    Arguments:
+    results - the store.ResultsStore
+    args - the command line arguments, database, run and complex are used
+
+    returns (run id, replications of the run)
+    """
+    game = "qcomplex_snake.QGame" if args.complex else "qsnake.QGame"
+    run = args.run if args.run else results.latestRun(game)
+    if run is None:
+        raise ValueError(f"{args.database} has no runs of {game}")
+    replications = next((row['replications'] for row in results.runs() if row['id'] == run), None)
+    if replications is None:
+        raise ValueError(f"{args.database} has no run {run}")
+    return run, replications
+
+def compare_database_runs(args):
+    """
+    Compares the mean scores of the run with those of the -compare run of a
+    SQLite results store (see store.ResultsStore.compareRuns())
+
+    Arguments:
+    args - the command line arguments, database, run, complex and compare are used
+
+    returns (run id, list of rows of the comparison, one per trial count)
+    """
+    import store
+    results = store.ResultsStore(args.database)
+    run, _ = find_database_run(results, args)
+    comparison = [dict(row) for row in results.compareRuns(run, args.compare)]
+    results.close()
+    return run, comparison
+
+def find_database_data(args):
+    """
+    Reads the statistics of a run from a SQLite results store (see store.py).
+    The means and confidence intervals are computed by SQLite.
+
+    Arguments:
+    args - the command line arguments, database, run, complex, confidence_interval and describe are used
+
+    returns (list of trial counts, list of mean scores, replications of the run)
+    """
+    import store
+    results = store.ResultsStore(args.database)
+    run, replications = find_database_run(results, args)
+
+    statistics = [dict(row) for row in results.trialStatistics(run, within_interval=args.confidence_interval)]
+    if args.bootstrap:
+        # SQLite can't resample, so the bootstrap intervals are computed here
+        bootstrap = trial_statistics(score_matrix([results.scores(run, row['trials']) for row in statistics]),
+            within_interval=args.confidence_interval, bootstrap=args.bootstrap)
+        for row, low, high in zip(statistics, bootstrap['bootstrap_low'], bootstrap['bootstrap_high']):
+            row['bootstrap_low'], row['bootstrap_high'] = low.item(), high.item()
+    if args.describe:
+        for row in statistics:
+            print(row['trials'], row)
+    results.close()
+    return [row['trials'] for row in statistics], [row['mean'] for row in statistics], replications
+
+def find_archive_data(args):
+    """
+    Reads the scores of a run from a store.ScoreArchive. The scores of every
+    trial count are memory mapped, not parsed.
+
+    Arguments:
+    args - the command line arguments, archive, run, complex, confidence_interval and describe are used
+
+    returns (list of trial counts, list of mean scores, replications of the run)
+    """
+    import store
+    archive = store.ScoreArchive(args.archive)
+    game = "qcomplex_snake.QGame" if args.complex else "qsnake.QGame"
+    run = args.run if args.run else archive.latestRun(game)
+    if run is None:
+        raise ValueError(f"{args.archive} has no runs of {game}")
+    replications = next((row['replications'] for row in archive.runs() if row['id'] == run), None)
+    if replications is None:
+        raise ValueError(f"{args.archive} has no run {run}")
+
+    scores = archive.trialScores(run)
+    statistics = trial_statistics(score_matrix(list(scores.values())), within_interval=args.confidence_interval,
+        bootstrap=args.bootstrap)
+    if args.describe:
+        print_statistics(list(scores), statistics)
+    return list(scores), list(statistics['mean']), replications
+
 def parseArgs():
     """
     Parses the command line arguments. 
@@ -84,88 +154,163 @@ def parseArgs():
     parser.add_argument('-suppress', '-s', action="store_true")
     parser.add_argument('-linear', '-l', action="store_true")
     parser.add_argument('-confidence-interval', '-ci', action="store_true")
+    parser.add_argument('-bootstrap', '-bs', type=int, default=0, metavar='B',
+        help="Also compute bootstrap confidence intervals of the means from B resamples (shown by -describe)")
     parser.add_argument('-cutoff', '-co', type=int, default=0)
     parser.add_argument('-complex', '-cp', action="store_true")
     parser.add_argument('-extrapolate', '-e', type=int, metavar='E')
     parser.add_argument('-raw', '-r', action="store_true")
+    parser.add_argument('-database', '-db', help="Read a run from this SQLite results store instead")
+    parser.add_argument('-archive', '-a', help="Read a run from this store.ScoreArchive directory instead")
+    parser.add_argument('-run', type=int, help="Run to graph from the database or archive, the newest one by default")
+    parser.add_argument('-compare', type=int, metavar='RUN', help="Compare the run with another one of the database")
+    parser.add_argument('-runs', action="store_true", help="List the runs in the database")
+    parser.add_argument('-batch', '-b', metavar='RUNS',
+        help="Plot these runs to files instead, like 1-5,8 or all (trainings of the file without -database or -archive)")
+    parser.add_argument('-out', '-o', default="plots", help="Directory the batch writes its plots to")
+    parser.add_argument('-format', '-f', choices=["png", "svg"], default="png", help="File format of the batch plots")
+    parser.add_argument('-processes', '-p', type=int, help="Processes the batch plots with, every core by default")
     return parser.parse_args()
 
-def mean_confidence_interval(data, confidence=0.95):
+def score_matrix(scores):
     """
-    Returns the confidence interval for the given data.
+    Pads the scores of every trial count into one array
 
-    Argument list:
-    :param data: The data to take the CI from
-    :param confidence: the amount of confidence we want to have from the data
-    """
-    if type(data) != type(np.array([0])):
-        raise ValueError(
-        f"The given array has type {type(data)} but should be of type {type(np.array([0]))}")
-
-    number_of_elements = len(data)
-    average, standard_error = np.mean(data), sem(data)
-    interval = standard_error * t.ppf((1 + confidence) / 2., number_of_elements-1)
-    return average, average - interval, average + interval
+    Arguments:
+    scores - list of the final scores of every trial count, which can have different lengths
 
-def parseData(data_list, scores, confidence_interval = False, verbose = False):
+    returns a (trial counts, replications) float array, padded with NaN
     """
-    Places the confidence interval data into the given list
+    matrix = np.full((len(scores), max(map(len, scores), default=0)), np.nan)
+    for row, data in enumerate(scores):
+        matrix[row, :len(data)] = data
+    return matrix
 
-    Keyword arguments:
-    data_list - empty list
+def moments(matrix, confidence=0.95):
     """
-    if not isinstance(data_list, list) or data_list: 
-        raise ValueError(
-        f"The given data has type {type(data_list)} but should be of type list")
-
-    for index, data in enumerate(scores):
-        _, low, high = mean_confidence_interval(np.array(data))
-
-        if confidence_interval:
-            #Don't modify iterable while iterating
-            copy_data = data
-            for num in copy_data:
-                if num < low or num > high:
-                    data.remove(num)
-
-        data_list.append(describe(data))
-
-        if verbose:
-            print(index * 10 + 10, describe(data))
+    Returns the count, mean, variance, min, max and t-interval of the mean of
+    every row of a score_matrix(), ignoring the NaN padding
+    """
+    valid = ~np.isnan(matrix)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, matrix, 0).sum(axis=1) / count
+        variance = (np.where(valid, matrix - mean[:, None], 0) ** 2).sum(axis=1) / (count - 1)
+        interval = np.sqrt(variance / count) * t.ppf((1 + confidence) / 2., count - 1)
+    return {
+        'count': count,
+        'mean': mean,
+        'variance': variance,
+        'min': np.where(valid, matrix, np.inf).min(axis=1, initial=np.inf),
+        'max': np.where(valid, matrix, -np.inf).max(axis=1, initial=-np.inf),
+        'low': mean - interval,
+        'high': mean + interval
+    }
+
+def bootstrap_interval(matrix, resamples, confidence=0.95, seed=None):
+    """
+    Bootstraps the mean of every row of a score_matrix() at once.
 
-def main():
-    """Driver"""
+    Scores only take a few distinct values, so instead of drawing every
+    replication of a resample, a resample is drawn as the number of times it
+    picks every distinct value (a multinomial of the row's histogram). That
+    costs the same whatever the number of replications.
 
-    args = parseArgs()
-    if args.complex:
-        file_name = "complex_train_file.txt"
-    else:
-        file_name = "train_file.txt"
-
-    data = find_training_data(file_name, args.count_to_find)
+    Arguments:
+    matrix - (trial counts, replications) array, padded with NaN
+    resamples - number of bootstrap resamples
+    confidence - confidence of the intervals
+    seed - seed of the resamples
 
-    final_scores = []
-    trials = []
+    returns (array of lows, array of highs) of the percentile intervals
+    """
+    rng = np.random.default_rng(seed)
+    rows = len(matrix)
+    valid = ~np.isnan(matrix)
+    count = valid.sum(axis=1)
+    values, positions = np.unique(matrix[valid], return_inverse=True)
+    row_of = np.nonzero(valid)[0]
+    histogram = np.bincount(row_of * len(values) + positions, minlength=rows * len(values)).reshape(rows, len(values))
+    # Rows without scores draw from a dummy histogram and are set to NaN below
+    pvals = np.where(count[:, None] > 0, histogram / np.maximum(count, 1)[:, None], 0)
+    pvals[count == 0, 0] = 1
+
+    means = np.empty((resamples, rows))
+    chunk = max(1, 2**22 // max(1, rows * len(values))) # Resamples at a time, bounds the memory used
+    for start in range(0, resamples, chunk):
+        stop = min(start + chunk, resamples)
+        picks = rng.multinomial(count, pvals, size=(stop - start, rows))
+        means[start:stop] = picks @ values / np.maximum(count, 1)
+    means[:, count == 0] = np.nan
+    low, high = np.quantile(means, [(1 - confidence) / 2., (1 + confidence) / 2.], axis=0)
+    return low, high
+
+def trial_statistics(matrix, confidence=0.95, within_interval=False, bootstrap=0, seed=None):
+    """
+    Computes the statistics of every trial count at once
 
-    replications = data[0]['replications']
-    for d in data:
-        final_scores.append(d['final_scores'])
-        trials.append(d['trials'])
+    Arguments:
+    matrix - (trial counts, replications) array from score_matrix()
+    confidence - confidence of the intervals
+    within_interval - only count the scores inside the t-interval of their trial count (-ci)
+    bootstrap - number of bootstrap resamples, no bootstrap intervals if 0
+    seed - seed of the bootstrap resamples
+
+    returns a dictionary of arrays with an item per trial count: count, mean,
+    variance, min, max, low and high (the t-interval) and, when bootstrapping,
+    bootstrap_low and bootstrap_high
+    """
+    statistics = moments(matrix, confidence)
+    if within_interval:
+        # NaN compares False, so the padding is never outside
+        outside = (matrix < statistics['low'][:, None]) | (matrix > statistics['high'][:, None])
+        matrix = np.where(outside, np.nan, matrix)
+        statistics = moments(matrix, confidence)
+    if bootstrap:
+        statistics['bootstrap_low'], statistics['bootstrap_high'] = bootstrap_interval(
+            matrix, bootstrap, confidence, seed)
+    return statistics
+
+def print_statistics(trials, statistics):
+    """Prints the statistics from trial_statistics() of every trial count"""
+    for index, count in enumerate(trials):
+        print(count, {name: values[index].item() for name, values in statistics.items()})
+
+def file_data(data, args):
+    """
+    Computes the means of a training read from train_file.txt
 
-    formatted_scores = []
+    Arguments:
+    data - the records of the training, from find_training_data()
+    args - the command line arguments, confidence_interval, bootstrap and describe are used
 
-    for t in final_scores:
-        formatted_scores.append(undo(t))
+    returns (list of trial counts, list of mean scores, replications of the training)
+    """
+    trials = [d['trials'] for d in data]
+    statistics = trial_statistics(score_matrix([[int(score) for score in d['final_scores'].split()] for d in data]),
+        within_interval=args.confidence_interval, bootstrap=args.bootstrap)
+    if args.describe:
+        print_statistics(trials, statistics)
+    return trials, list(statistics['mean']), data[0]['replications']
+
+def plot_fit(trials, means, replications, args, name=None):
+    """
+    Draws the means of a run and the fit of them on the current figure
 
-    describes = []
-    parseData(describes, formatted_scores, args.confidence_interval, args.describe)
+    Arguments:
+    trials - list of trial counts
+    means - list of the mean scores of the trial counts
+    replications - replications of the run
+    args - the command line arguments, linear, raw and extrapolate are used
+    name - shown above the replications, like the run
 
+    returns the r2 score of the fit, None with -linear and -raw
+    """
     model = LinearRegression()
 
     x = np.asarray(trials).reshape(-1, 1)
 
-    y = [d.mean for d in describes]
-    y = np.asarray(y).reshape(-1, 1)
+    y = np.asarray(means).reshape(-1, 1)
 
     model_y = y
 
@@ -178,18 +323,18 @@ def main():
     plt.xlabel("Number of Trials")
     plt.figtext(.1, .9, f"Replications: {replications}")
     plt.title("Average Snake length vs trials")
+    if name:
+        plt.figtext(.1, .95, name)
 
     if args.linear:
         plt.scatter(x, y_lin)
         plt.plot(x, y_new, color='red', label="linear-fit")
-        plt.show()
-        exit()
+        return None
 
     plt.scatter(x, y, label = "original-data")
 
     if args.raw:
-        plt.show()
-        exit()
+        return None
 
     if args.extrapolate:
         if args.extrapolate < max(x)[0]:
@@ -209,11 +354,11 @@ def main():
             indexes += [index]
 
     if indexes:
-        fixed_x = [x[indexes[0]], x[indexes[-1] + 1]]
+        fixed_x = [x[indexes[0]][0], x[indexes[-1] + 1][0]]
         x = x[indexes[-1] + 1:]
         y_new = np.log(y_new[indexes[-1] + 1:]) 
         y = y[indexes[-1] + 1:] 
-        fixed_y = [1, y_new[0]]
+        fixed_y = [1, y_new[0][0]]
         plt.plot(fixed_x, fixed_y, ':', color="red",  label="non-transformable")
     else:
         y_new = np.log(y_new) 
@@ -222,11 +367,200 @@ def main():
 
     plt.legend()
     #print(r2_score(y[indexes[-1] + 1:], y_new))
-    print(r2_score(y, y_new))
     #print(f"y = ln({model.coef_}x + {model.intercept_})") #Equation of the line
+    return r2_score(y, y_new)
+
+def parse_runs(text, every_run):
+    """
+    Reads a list of runs like "1-5,8" or "all"
+
+    Arguments:
+    text - comma separated run ids and inclusive ranges of them
+    every_run - the runs "all" stands for
+
+    returns a list of run ids, raises ValueError if the text isn't a list of runs
+    """
+    if text == "all":
+        return list(every_run)
+    runs = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        try:
+            runs += range(int(first), int(last or first) + 1)
+        except ValueError:
+            raise ValueError(f"{part!r} is not a run or a range of runs like 1-5") from None
+    return runs
+
+def batch_source(args, file_name):
+    """
+    Finds where a batch reads its runs from: the archive, the database or the training file
+
+    Arguments:
+    args - the command line arguments
+    file_name - the training file, used without -archive and -database
+
+    returns (file that changes when the runs do, list of every run, function of a run
+    to (list of trial counts, list of mean scores, replications))
+    """
+    import store
+    def run_args(run):
+        return argparse.Namespace(**{**vars(args), 'run': run, 'describe': False, 'compare': None})
+
+    if args.archive:
+        every_run = [run['id'] for run in store.ScoreArchive(args.archive).runs()]
+        return os.path.join(args.archive, "index.npy"), every_run, lambda run: find_archive_data(run_args(run))
+    if args.database:
+        results = store.ResultsStore(args.database)
+        every_run = [run['id'] for run in results.runs()]
+        results.close()
+        return args.database, every_run, lambda run: find_database_data(run_args(run))
+
+    with open(file_name) as f:
+        first_line = f.readline().strip()
+    every_run = range(1, int(first_line[first_line.find('=') + 1:]) + 1)
+    trainings = [] # The whole file is read once, the first time a run isn't cached
+    def load(run):
+        if not trainings:
+            trainings.extend(store.readTrainFile(file_name))
+        return file_data(trainings[run - 1], run_args(run))
+    return file_name, every_run, load
+
+CACHE_VERSION = 1
+
+def load_cache(file_name):
+    """
+    Returns the cached runs saved by a batch, an empty dictionary if there are
+    none or they were saved by another version
+    """
+    try:
+        with open(file_name) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache.get('runs', {}) if cache.get('version') == CACHE_VERSION else {}
+
+def render_plot(task):
+    """
+    Plots a run into a file, in a worker of the batch pool
+
+    Arguments:
+    task - (run, trial counts, means, replications, command line arguments, file to save to)
+
+    returns (run, r2 score or None, error message or None)
+    """
+    run, trials, means, replications, args, out_file = task
+    plt.figure()
+    try:
+        r2 = plot_fit(trials, means, replications, args, name=f"Run: {run}")
+        plt.gcf().savefig(out_file) # plt.savefig() would draw the figure a second time
+        return run, r2, None
+    except Exception as error:
+        return run, None, f"{type(error).__name__}: {error}"
+    finally:
+        plt.close()
+
+def batch(args, file_name):
+    """
+    Plots many runs into files without a display. The means of every run are
+    cached in the output directory, keyed by the file they were read from and
+    when it last changed, so plotting them again doesn't read them again. The
+    plots are drawn by a pool of processes with the Agg backend.
+
+    Arguments:
+    args - the command line arguments
+    file_name - the training file, used without -archive and -database
+
+    returns the number of runs that failed to plot
+    """
+    start = time.perf_counter()
+    os.makedirs(args.out, exist_ok=True)
+    source, every_run, load = batch_source(args, file_name)
+    stamp = [os.stat(source).st_mtime_ns, os.stat(source).st_size]
+    cache_file = os.path.join(args.out, "graph_cache.json")
+    cache = load_cache(cache_file)
+
+    try:
+        runs = parse_runs(args.batch, every_run)
+    except ValueError as error:
+        print(f"Bad -batch: {error}")
+        return 1
+    unknown = [run for run in runs if run not in every_run]
+    for run in unknown:
+        print(f"Run: {run}; FAILED: {args.archive or args.database or file_name} has no run {run}")
+    runs = [run for run in runs if run in every_run]
+
+    tasks = []
+    cached = 0
+    for run in runs:
+        key = f"{os.path.abspath(source)}|{run}|{int(args.confidence_interval)}"
+        if cache.get(key, {}).get('stamp') == stamp:
+            cached += 1
+        else:
+            trials, means, replications = load(run)
+            cache[key] = {'stamp': stamp, 'trials': [int(count) for count in trials],
+                'means': [float(mean) for mean in means], 'replications': int(replications)}
+        entry = cache[key]
+        prefix = "complex_run" if args.complex else "run"
+        tasks.append((run, entry['trials'], entry['means'], entry['replications'], args,
+            os.path.join(args.out, f"{prefix}_{run}.{args.format}")))
+
+    with open(cache_file, "w") as f:
+        json.dump({'version': CACHE_VERSION, 'runs': cache}, f)
+
+    with multiprocessing.Pool(args.processes, initializer=plt.switch_backend, initargs=("Agg",)) as pool:
+        plotted = pool.map(render_plot, tasks)
+        pool.close()
+        pool.join()
+
+    failed = len(unknown)
+    for (run, r2, error), task in zip(plotted, tasks):
+        if error:
+            failed += 1
+            print(f"Run: {run}; FAILED: {error}")
+        else:
+            print(f"Run: {run}; R2: {r2}; File: {task[-1]}")
+    print(f"Plotted {len(tasks) + len(unknown) - failed} of {len(tasks) + len(unknown)} runs ({cached} cached) to {args.out} "
+        f"in {time.perf_counter() - start:.2f} s")
+    return failed
+
+def main():
+    """Driver"""
+
+    args = parseArgs()
+    if args.complex:
+        file_name = "complex_train_file.txt"
+    else:
+        file_name = "train_file.txt"
+
+    if args.database and args.runs:
+        import store
+        for run in store.ResultsStore(args.database).runs():
+            print(f"Run: {run['id']}; Created: {run['created']}; Game: {run['game']}; "
+                f"Replications: {run['replications']}; Trial counts: {run['trial_counts']}")
+        exit()
+
+    if args.batch:
+        exit(1 if batch(args, file_name) else 0)
+
+    if args.database and args.compare:
+        run, comparison = compare_database_runs(args)
+        for row in comparison:
+            print(f"Trials: {row['trials']}; Run {run}: {row['mean']:.2f}; Run {args.compare}: {row['other_mean']:.2f}; "
+                f"Difference: {row['difference']:+.2f}; {'overlapping' if row['overlap'] else 'SEPARATE'} intervals")
+        exit()
+
+    if args.archive:
+        trials, means, replications = find_archive_data(args)
+    elif args.database:
+        trials, means, replications = find_database_data(args)
+    else:
+        trials, means, replications = file_data(find_training_data(file_name, args.count_to_find), args)
 
+    r2 = plot_fit(trials, means, replications, args)
+    if r2 is not None:
+        print(r2)
 
-    if not args.suppress:
+    if args.linear or args.raw or not args.suppress:
         plt.show()
 
 if __name__ == "__main__":
@@ -0,0 +1,337 @@
+#! /usr/bin/env python3
+"""
+Generates layouts of redirection blocks for complex_snake.
+
+Blocks are placed one at a time on an occupancy grid. A block is only kept if
+the free cells of the board are still connected afterwards, so the snake can
+always reach every free cell (ignoring its own tail). Most candidates are
+accepted by looking at their eight neighbours. When the neighbourhood alone
+can't tell, searches from the separated neighbours check that they still
+meet, which only floods the smaller side of a split.
+
+Layouts can also be generated ahead of time into a library: a single .npy
+file of shape (layouts, obstacles, 2) holding the (column, row) of every
+obstacle. Games load a layout from it by index without generating anything.
+
+Usage:
+    python layout.py build -count K [-columns C] [-rows R] [-blocks B] [-seed S] [-processes P] [-out FILE]
+    python layout.py benchmark
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+import numpy as np
+
+# The eight neighbours of a cell, walking around it
+RING = ((0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1))
+
+
+def generateLayout(columns, rows, count, rng=None, reserved=(), max_attempts=None):
+    """
+    Places obstacles on the board keeping the free cells connected
+
+    Arguments:
+    columns, rows - size of the board in cells
+    count - number of obstacles to place
+    rng - random.Random to place the obstacles with
+    reserved - (column, row) cells that must stay free, like the snake's start
+    max_attempts - number of candidates to try before giving up (default 20 * count + 100)
+
+    returns a (count, 2) numpy array of (column, row)
+    """
+    rng = rng if rng is not None else random.Random()
+    max_attempts = max_attempts if max_attempts is not None else 20 * count + 100
+    stride = columns + 2
+    # Padded occupancy grid, the border counts as blocked
+    grid = bytearray(b"\x01" * stride + (b"\x01" + b"\x00" * columns + b"\x01") * rows + b"\x01" * stride)
+    reserved_cells = {(row + 1) * stride + column + 1 for column, row in reserved}
+    ring = [dy * stride + dx for dx, dy in RING]
+    placed = []
+
+    attempts = 0
+    while len(placed) < count:
+        attempts += 1
+        if attempts > max_attempts:
+            raise ValueError(f"Could only place {len(placed)} of {count} obstacles on a {columns}x{rows} board")
+
+        column, row = rng.randint(0, columns - 1), rng.randint(0, rows - 1)
+        cell = (row + 1) * stride + column + 1
+        if grid[cell] or cell in reserved_cells:
+            continue
+
+        grid[cell] = 1
+        starts = separatedNeighbours(grid, cell, ring)
+        if len(starts) <= 1 or searchesMeet(grid, stride, starts):
+            placed.append((column, row))
+        else:
+            grid[cell] = 0
+
+    return np.array(placed, dtype=np.int32).reshape(-1, 2)
+
+
+def separatedNeighbours(grid, cell, ring):
+    """
+    Walks around a newly blocked cell and groups its free neighbours into runs
+    that are connected to each other without going through the cell.
+
+    Arguments:
+    grid - padded occupancy grid
+    cell - index of the blocked cell
+    ring - offsets of the eight neighbours in order around the cell
+
+    returns one free orthogonal neighbour for every run that has one. If there
+    is at most one, blocking the cell can't have split the board.
+    """
+    blocked = [grid[cell + offset] for offset in ring]
+    start = blocked.index(1) if 1 in blocked else 0
+    representatives = []
+    in_run = False
+    counted = False
+    for step in range(1, 9):
+        index = (start + step) % 8
+        if blocked[index]:
+            in_run = False
+            continue
+        if not in_run:
+            in_run = True
+            counted = False
+        if index % 2 == 0 and not counted: # Even indexes are the orthogonal neighbours
+            representatives.append(cell + ring[index])
+            counted = True
+    return representatives
+
+
+def searchesMeet(grid, stride, starts):
+    """
+    Runs a breadth first search from every start cell at the same time, joining
+    searches that run into each other. Stops as soon as they have all joined, or
+    one of them runs out of cells to visit (it is closed off from the others).
+    That way only the smaller side of a split is ever searched completely.
+
+    Arguments:
+    grid - padded occupancy grid
+    stride - width of a row of the padded grid
+    starts - free cells to connect
+
+    returns True if every start cell can reach every other
+    """
+    owner = {start: index for index, start in enumerate(starts)}
+    parents = list(range(len(starts)))
+    pending = [1] * len(starts)
+    queues = [deque([start]) for start in starts]
+    groups = len(starts)
+    offsets = (-stride, stride, -1, 1)
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    while True:
+        for index, queue in enumerate(queues):
+            if not queue:
+                continue
+            cell = queue.popleft()
+            root = find(index)
+            pending[root] -= 1
+            for offset in offsets:
+                neighbour = cell + offset
+                if grid[neighbour]:
+                    continue
+                other = owner.get(neighbour)
+                if other is None:
+                    owner[neighbour] = index
+                    queue.append(neighbour)
+                    pending[root] += 1
+                elif find(other) != root:
+                    other_root = find(other)
+                    parents[other_root] = root
+                    pending[root] += pending[other_root]
+                    groups -= 1
+                    if groups == 1:
+                        return True
+            if pending[root] == 0:
+                return False
+
+
+def isConnected(cells, columns, rows, reserved=()):
+    """
+    Validates a layout independently of how it was generated: every obstacle is
+    on the board, no two share a cell, the reserved cells are free and the
+    free cells are connected.
+
+    Arguments:
+    cells - (obstacles, 2) array of (column, row)
+    columns, rows - size of the board in cells
+    reserved - (column, row) cells that must be free
+    """
+    grid = np.zeros((rows, columns), dtype=bool)
+    for column, row in cells:
+        if not (0 <= column < columns and 0 <= row < rows) or grid[row, column]:
+            return False
+        grid[row, column] = True
+    if any(grid[row, column] for column, row in reserved):
+        return False
+
+    free = np.argwhere(~grid)
+    if len(free) == 0:
+        return True
+    seen = grid.copy()
+    queue = deque([tuple(free[0])])
+    seen[free[0][0], free[0][1]] = True
+    reached = 1
+    while queue:
+        row, column = queue.popleft()
+        for next_row, next_column in ((row - 1, column), (row + 1, column), (row, column - 1), (row, column + 1)):
+            if 0 <= next_row < rows and 0 <= next_column < columns and not seen[next_row, next_column]:
+                seen[next_row, next_column] = True
+                reached += 1
+                queue.append((next_row, next_column))
+    return reached == len(free)
+
+
+def buildLayout(columns, rows, count, seed, reserved=()):
+    """
+    Generates and validates one layout of a library
+
+    Arguments:
+    columns, rows - size of the board in cells
+    count - number of obstacles
+    seed - numpy SeedSequence of the layout
+    reserved - (column, row) cells that must stay free
+
+    returns the layout as a (count, 2) array
+    """
+    rng = random.Random(int.from_bytes(seed.generate_state(4).tobytes(), "little"))
+    cells = generateLayout(columns, rows, count, rng, reserved)
+    if not isConnected(cells, columns, rows, reserved):
+        raise RuntimeError(f"Generated layout {seed.spawn_key} failed validation")
+    return cells
+
+
+def buildLibrary(file_name, layouts, columns=20, rows=15, count=10, seed=0, reserved=(), processes=None):
+    """
+    Generates a library of layouts in parallel and saves it to a .npy file
+
+    Arguments:
+    file_name - where to save the library
+    layouts - number of layouts to generate
+    columns, rows - size of the board in cells
+    count - number of obstacles in every layout
+    seed - root seed, layout i is generated from its i'th child
+    reserved - (column, row) cells that must stay free in every layout
+    processes - size of the process pool, every core by default
+
+    returns the number of seconds it took
+    """
+    start = time.perf_counter()
+    root = np.random.SeedSequence(seed)
+    tasks = [(columns, rows, count, np.random.SeedSequence(root.entropy, spawn_key=(index,)), tuple(reserved))
+        for index in range(layouts)]
+    with multiprocessing.Pool(processes) as pool:
+        library = pool.starmap(buildLayout, tasks, chunksize=max(1, layouts // (4 * (processes or os.cpu_count()))))
+        # Workers forked after pygame.init() ignore SIGTERM, so let them exit instead of terminating them
+        pool.close()
+        pool.join()
+
+    np.save(file_name, np.array(library, dtype=np.uint16).reshape(layouts, count, 2))
+    return time.perf_counter() - start
+
+
+def libraryName(columns, rows, count):
+    """Default file name of a library for the given board"""
+    return f"layouts_{columns}x{rows}_{count}.npy"
+
+
+class LayoutLibrary():
+    """
+    A library of layouts saved by buildLibrary(). The file is memory mapped so
+    opening it is instant whatever its size.
+
+    Public Methods:
+    len(library)
+    library[index]
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.layouts = np.load(file_name, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.layouts)
+
+    def __getitem__(self, index):
+        """Returns layout number index as a (obstacles, 2) array of (column, row)"""
+        return np.asarray(self.layouts[index], dtype=np.int32)
+
+
+def benchmark(boards=((20, 15, 10), (20, 15, 60), (50, 50, 250), (100, 100, 1000), (200, 200, 4000)), layouts=5, seed=0):
+    """
+    Times the generation of layouts of increasing size
+
+    Arguments:
+    boards - list of (columns, rows, obstacles)
+    layouts - number of layouts generated per board
+    seed - seed of the generator
+
+    returns a list of dictionaries, one per board
+    """
+    rng = random.Random(seed)
+    results = []
+    for columns, rows, count in boards:
+        start = time.perf_counter()
+        for index in range(layouts):
+            generateLayout(columns, rows, count, rng)
+        seconds = (time.perf_counter() - start) / layouts
+        results.append({'columns': columns, 'rows': rows, 'obstacles': count, 'ms': seconds * 1000})
+        print(f"Board: {columns}x{rows}; Obstacles: {count}; Generation: {seconds * 1000:.2f} ms")
+    return results
+
+
+def parseArgs():
+    """
+    Parses the command line arguments.
+
+    Returns them as a Namespace object
+    """
+    parser = argparse.ArgumentParser(description="Generate redirection block layouts.")
+    parser.add_argument('command', choices=["build", "benchmark"])
+    parser.add_argument('-count', '-k', type=int, default=100, help="Number of layouts in the library")
+    parser.add_argument('-columns', type=int, default=20)
+    parser.add_argument('-rows', type=int, default=15)
+    parser.add_argument('-blocks', '-b', type=int, default=10, help="Obstacles per layout")
+    parser.add_argument('-window-width', type=int, default=1280,
+        help="Width of the window of the game, used to find the snake's starting cell")
+    parser.add_argument('-seed', '-s', type=int, default=0)
+    parser.add_argument('-processes', '-p', type=int)
+    parser.add_argument('-out', '-o', help="File to save to, layouts_<columns>x<rows>_<blocks>.npy by default")
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    if args.command == "benchmark":
+        benchmark()
+        return
+
+    # The snake's starting cell (and the one above it) must stay free
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import snake
+    size = 40
+    game = snake.Game(size, windowHeight=args.rows * size, windowWidth=args.window_width,
+        gameHeight=args.rows * size, gameWidth=args.columns * size, screen=False)
+    column, row = game.cellOf(game.snake.x, game.snake.y)
+
+    out = args.out if args.out else libraryName(args.columns, args.rows, args.blocks)
+    seconds = buildLibrary(out, args.count, args.columns, args.rows, args.blocks, args.seed,
+        [(column, row), (column, row - 1)], args.processes)
+    print(f"Saved {args.count} layouts of {args.blocks} obstacles on a {args.columns}x{args.rows} board "
+        f"to {out} in {seconds:.2f} s ({os.path.getsize(out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#! /usr/bin/env python3
+"""
+Monte Carlo tree search agent for snake.Game and complex_snake.Game.
+
+The agent doesn't learn anything, it is a baseline to compare QGame against.
+Every move it plays a budget of simulated games on clones of the real game
+(see snake.Game.clone()) and picks the action that was explored the most.
+
+Usage:
+    python mcts.py [-complex] [-rollouts N] [-time T] [-processes P] [--render]
+    python mcts.py --benchmark [-complex] [-games G] [-processes P]
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import time
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide" #Don't show the pygame startup message
+import pygame
+import snake
+import replay
+import constant
+
+DIRECTIONS = {name: snake.Direction[name] for name in constant.COLUMNS}
+MOVE_BITS = {direction.name: bit for bit, direction in enumerate(snake.Snake.MOVES)} # Bits of Snake.safeMoves()
+
+
+class Node():
+    """
+    Node of the search tree. The tree is open loop: a node is reached by a
+    sequence of actions, whatever food placement happened on the way.
+
+    Instance Variables:
+    action - the action that leads to this node
+    children - dictionary of action to Node
+    visits - number of simulations that went through this node
+    value - sum of the values of those simulations
+    """
+
+    def __init__(self, parent=None, action=None):
+        self.parent = parent
+        self.action = action
+        self.children = {}
+        self.visits = 0
+        self.value = 0.0
+
+    def select(self, exploration):
+        """
+        Returns the child with the highest UCT value
+        """
+        log_visits = math.log(self.visits)
+        return max(self.children.values(), key=lambda child: child.value / child.visits
+            + exploration * math.sqrt(log_visits / child.visits))
+
+
+def legalActions(game):
+    """
+    Returns the actions worth exploring from the current state. Going
+    backwards is skipped because changeDirection() ignores it once the snake has
+    a tail.
+    """
+    if not game.snake.tail:
+        return constant.COLUMNS
+    backwards = (-game.snake.dx, -game.snake.dy)
+    return [name for name in constant.COLUMNS
+        if (DIRECTIONS[name].value[0] * game.size, DIRECTIONS[name].value[1] * game.size) != backwards]
+
+
+def applyAction(game, action):
+    """Moves the snake of the game one step in the direction of the action"""
+    game.snake.changeDirection(DIRECTIONS[action])
+    game.snake.move()
+
+
+def safeActions(game):
+    """
+    Returns the actions that don't run into a wall, the tail or a redirection
+    block, from the snake's safe-move mask. O(1)
+    """
+    snake_obj = game.snake
+    safe = snake_obj.safeMoves()
+    if snake_obj.tail:
+        # The end of the tail moves away before the head gets there
+        end = snake_obj.tail[0]
+        if snake_obj.occupancy[game.cellIndex(end.x, end.y)] == 1 and not game.isBlocked(end.x, end.y):
+            for bit, (dx, dy) in enumerate(snake_obj.MOVE_STEPS):
+                if (snake_obj.x + dx * game.size, snake_obj.y + dy * game.size) == (end.x, end.y):
+                    safe |= 1 << bit
+    return [action for action in legalActions(game) if safe >> MOVE_BITS[action] & 1]
+
+
+def randomPolicy(game, rng):
+    """Rollout policy choosing uniformly between the legal actions"""
+    return rng.choice(legalActions(game))
+
+
+def heuristicPolicy(game, rng):
+    """
+    Rollout policy choosing a safe action that gets closer to the food (going
+    around the obstacles), or any safe action if there is none.
+    """
+    safe = safeActions(game)
+    if not safe:
+        return randomPolicy(game, rng)
+
+    closer = []
+    field = game.food.distanceField
+    distance = game.snake.pathDistanceToFood()
+    for action in safe:
+        dx, dy = DIRECTIONS[action].value
+        column, row = game.cellOf(game.snake.x + dx * game.size, game.snake.y + dy * game.size)
+        if 0 <= field[row, column] and (distance < 0 or field[row, column] < distance):
+            closer.append(action)
+    return rng.choice(closer if closer else safe)
+
+
+POLICIES = {"random": randomPolicy, "heuristic": heuristicPolicy}
+
+
+class MCTSAgent():
+    """
+    Chooses actions for a game by Monte Carlo tree search
+
+    Public Methods:
+    chooseAction(game)
+    search(game)
+    close()
+
+    Instance Variables:
+    rollouts - number of simulations per move (None for no limit)
+    time_limit - seconds to search per move (None for no limit)
+    depth - maximum number of steps in a simulation
+    policy - name of the rollout policy, "random" or "heuristic"
+    exploration - UCT exploration constant
+    processes - number of processes searching the root in parallel
+    discount - discount factor of the rewards in a simulation
+    """
+
+    def __init__(self, rollouts=200, time_limit=None, depth=40, policy="heuristic",
+        exploration=1.0, processes=1, seed=None, discount=.9):
+        if rollouts is None and time_limit is None:
+            raise ValueError("Either a rollout or a time budget is needed")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown rollout policy {policy}, use one of {list(POLICIES)}")
+        self.rollouts = rollouts
+        self.time_limit = time_limit
+        self.depth = depth
+        self.policy = policy
+        self.exploration = exploration
+        self.processes = processes
+        self.discount = discount
+        self.random = random.Random(seed)
+        self.pool = None
+
+    def chooseAction(self, game):
+        """
+        Searches from the current state of the game
+
+        returns the name of the action to take (see constant.COLUMNS)
+        """
+        if self.processes > 1:
+            statistics = self.__searchParallel(game)
+        else:
+            statistics = self.search(game)
+
+        return max(statistics, key=lambda action: statistics[action])
+
+    def search(self, game):
+        """
+        Runs the simulations from the current state of the game
+
+        returns a dictionary of action to (visits, total value) of the root's children
+        """
+        return search(game, self.rollouts, self.time_limit, self.depth,
+            self.policy, self.exploration, self.random.getrandbits(64), self.discount)
+
+    def __searchParallel(self, game):
+        """
+        Root parallelism: every process builds its own tree from the same state
+        and the visits of the root's children are added together.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes)
+
+        rollouts = None if self.rollouts is None else max(1, self.rollouts // self.processes)
+        board, state = replay.describeBoard(game), game.snapshot()
+        tasks = [(board, state, rollouts, self.time_limit, self.depth, self.policy,
+            self.exploration, self.random.getrandbits(64), self.discount) for i in range(self.processes)]
+
+        statistics = {}
+        for result in self.pool.starmap(searchBoard, tasks):
+            for action, (visits, value) in result.items():
+                old_visits, old_value = statistics.get(action, (0, 0.0))
+                statistics[action] = (old_visits + visits, old_value + value)
+        return statistics
+
+    def close(self):
+        """Stops the processes used for root parallelism"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def simulateStep(game, action, steps, discount):
+    """
+    Applies the action to a simulated game
+
+    Arguments:
+    game - the simulated game
+    action - the action to take
+    steps - number of steps already simulated
+    discount - how much a reward loses per step, so food eaten sooner is worth more
+
+    returns the discounted reward of the step: one for eating and minus one for dying
+    """
+    score = game.score
+    applyAction(game, action)
+    return (game.score - score - game.done) * discount ** steps
+
+
+def evaluate(game, steps, discount):
+    """
+    Discounted bonus for ending a simulation alive and close to the food
+    """
+    if game.done:
+        return 0
+    cells = game.snake.distanceToFood() / game.size
+    return .5 / (1 + cells) * discount ** steps
+
+
+def search(game, rollouts, time_limit, depth, policy, exploration, seed, discount=.9):
+    """
+    Runs Monte Carlo tree search from the current state of the game. The game
+    isn't changed.
+
+    Arguments:
+    game - the game to search from
+    rollouts - number of simulations (None for no limit)
+    time_limit - seconds to search for (None for no limit)
+    depth - maximum number of steps in a simulation
+    policy - name of the rollout policy
+    exploration - UCT exploration constant
+    seed - seed for the simulations
+    discount - discount factor of the rewards
+
+    returns a dictionary of action to (visits, total value) of the root's children
+    """
+    rng = random.Random(seed)
+    rollout_policy = POLICIES[policy]
+    root = Node()
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    count = 0
+
+    while (rollouts is None or count < rollouts) and (deadline is None or time.perf_counter() < deadline):
+        count += 1
+        simulation = game.clone(seed=rng.getrandbits(64))
+        node = root
+        steps = 0
+        value = 0.0
+
+        # Selection
+        while not simulation.done and node.children and len(node.children) == len(legalActions(simulation)):
+            node = node.select(exploration)
+            value += simulateStep(simulation, node.action, steps, discount)
+            steps += 1
+
+        # Expansion
+        if not simulation.done:
+            untried = [action for action in legalActions(simulation) if action not in node.children]
+            if untried:
+                action = rng.choice(untried)
+                node.children[action] = Node(node, action)
+                node = node.children[action]
+                value += simulateStep(simulation, action, steps, discount)
+                steps += 1
+
+        # Rollout
+        while not simulation.done and steps < depth:
+            value += simulateStep(simulation, rollout_policy(simulation, rng), steps, discount)
+            steps += 1
+
+        # Backpropagation
+        value += evaluate(simulation, steps, discount)
+        while node is not None:
+            node.visits += 1
+            node.value += value
+            node = node.parent
+
+    return {action: (child.visits, child.value) for action, child in root.children.items()}
+
+
+worker_games = {}
+
+def searchBoard(board, state, rollouts, time_limit, depth, policy, exploration, seed, discount):
+    """
+    search() for worker processes: the game is built once per board and
+    process and put into the given GameState.
+    """
+    if board not in worker_games:
+        worker_games[board] = replay.buildGame(board)
+    game = worker_games[board]
+    game.restore(state)
+    return search(game, rollouts, time_limit, depth, policy, exploration, seed, discount)
+
+
+def playGame(game, agent, max_steps=1000, max_hunger=200, render=False, fps=10):
+    """
+    Plays the game with the agent until the snake dies, it hasn't eaten for
+    max_hunger steps or max_steps is reached
+
+    returns (score, steps, decisions per second)
+    """
+    steps = 0
+    hunger = 0
+    thinking = 0
+    while not game.done and steps < max_steps and hunger < max_hunger:
+        start = time.perf_counter()
+        action = agent.chooseAction(game)
+        thinking += time.perf_counter() - start
+
+        score = game.score
+        applyAction(game, action)
+        hunger = 0 if game.score > score else hunger + 1
+        steps += 1
+
+        if render:
+            pygame.event.pump()
+            game.drawBoard()
+            pygame.display.flip()
+            game.clock.tick(fps)
+
+    return game.score, steps, steps / thinking if thinking else 0.0
+
+
+def benchmark(budgets=(10, 50, 200), games=3, complex=False, processes=1, policy="heuristic", seed=0, max_steps=300):
+    """
+    Plays games of at most max_steps steps at increasing rollout budgets and
+    prints the decisions per second and the mean score for each budget
+
+    returns a list of dictionaries, one per budget
+    """
+    results = []
+    board = (complex, 40, 1280, 800, 600, None)
+    for budget in budgets:
+        agent = MCTSAgent(rollouts=budget, policy=policy, processes=processes, seed=seed)
+        scores, rates = [], []
+        for index in range(games):
+            score, steps, rate = playGame(replay.buildGame(board, seed=seed + index), agent, max_steps)
+            scores.append(score)
+            rates.append(rate)
+        agent.close()
+
+        result = {'rollouts': budget, 'processes': processes, 'policy': policy,
+            'complex': complex, 'games': games,
+            'mean_score': sum(scores) / games, 'decisions_per_second': sum(rates) / games}
+        results.append(result)
+        print(f"Rollouts: {budget}; Processes: {processes}; "
+            f"Decisions/sec: {result['decisions_per_second']:.1f}; Mean score: {result['mean_score']:.2f}")
+    return results
+
+
+def parseArgs():
+    """
+    Parses the command line arguments.
+
+    Returns them as a Namespace object
+    """
+    parser = argparse.ArgumentParser(description="Play snake with Monte Carlo tree search.")
+    parser.add_argument('-complex', '-cp', action="store_true", help="Play with redirection blocks")
+    parser.add_argument('-rollouts', '-r', type=int,
+        help="Simulations per move, 200 if neither -rollouts nor -time is given")
+    parser.add_argument('-time', '-t', type=float, help="Seconds to search per move")
+    parser.add_argument('-depth', type=int, default=40)
+    parser.add_argument('-policy', choices=list(POLICIES), default="heuristic")
+    parser.add_argument('-processes', '-p', type=int, default=1)
+    parser.add_argument('-games', '-g', type=int, default=3)
+    parser.add_argument('-seed', type=int, default=0)
+    parser.add_argument('--render', action="store_true")
+    parser.add_argument('--benchmark', action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    if not args.render:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+    if args.benchmark:
+        benchmark(games=args.games, complex=args.complex, processes=args.processes,
+            policy=args.policy, seed=args.seed)
+        return
+
+    rollouts = 200 if args.rollouts is None and args.time is None else args.rollouts
+    agent = MCTSAgent(rollouts=rollouts, time_limit=args.time, depth=args.depth,
+        policy=args.policy, processes=args.processes, seed=args.seed)
+    game = replay.buildGame((args.complex, 40, 1280, 800, 600, None), render=args.render, seed=args.seed)
+    score, steps, rate = playGame(game, agent, render=args.render)
+    agent.close()
+    print(f"Final score = {score}; steps = {steps}; decisions/sec = {rate:.1f}")
+
+
+if __name__ == "__main__":
+    main()
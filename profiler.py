@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+"""
+Times the phases of a step of the Q-Learning games.
+
+A StepProfiler is attached to a QGame like an EpisodeRecorder. While it is
+attached, QGame.step() laps it after every phase, adding the time of the
+phase to a total and to a histogram of powers of two nanoseconds. Games
+without a profiler only pay for checking that they don't have one.
+
+qsnake.train(..., profile=True) attaches one to the game of every worker and
+returns what they measured with the rest of the telemetry.
+"""
+import time
+
+import pygame
+
+PHASES = ("chooseAction", "changeDirection", "move", "encodeState", "getReward", "updateQValue", "resetText", "render")
+BUCKETS = 40 # Durations up to 2**40 ns (about 18 minutes), longer ones go in the last bucket
+
+
+class StepProfiler():
+    """
+    Accumulates the time spent in every phase of QGame.step()
+
+    Public Methods:
+    attach(game)
+    detach(game)
+    start()
+    lap(phase)
+    render(game)
+    add(phase, nanoseconds)
+    export()
+    clear()
+
+    Instance Variables:
+    totals - dictionary of phase to nanoseconds spent in it
+    counts - dictionary of phase to number of times it was timed
+    histograms - dictionary of phase to a list, item i counts the durations
+        of 2**(i-1) to 2**i - 1 nanoseconds
+    """
+
+    def __init__(self):
+        self.last = 0
+        self.clear()
+
+    def attach(self, game):
+        """Start timing the steps of the given game"""
+        game.profiler = self
+
+    def detach(self, game):
+        """Stop timing the steps of the given game"""
+        game.profiler = None
+
+    def clear(self):
+        """Forgets everything that was timed"""
+        self.totals = {phase: 0 for phase in PHASES}
+        self.counts = {phase: 0 for phase in PHASES}
+        self.histograms = {phase: [0] * BUCKETS for phase in PHASES}
+
+    def add(self, phase, nanoseconds):
+        """Adds one timing of the phase"""
+        self.totals[phase] += nanoseconds
+        self.counts[phase] += 1
+        self.histograms[phase][min(nanoseconds.bit_length(), BUCKETS - 1)] += 1
+
+    def start(self):
+        """Starts timing a phase"""
+        self.last = time.perf_counter_ns()
+
+    def lap(self, phase):
+        """Adds the time since start() or the last lap() to the phase, and starts timing the next one"""
+        now = time.perf_counter_ns()
+        self.add(phase, now - self.last)
+        self.last = now
+
+    def render(self, game):
+        """
+        Draws the game to the screen, timed as the render phase
+        """
+        start = time.perf_counter_ns()
+        game.drawBoard()
+        pygame.display.flip()
+        self.add("render", time.perf_counter_ns() - start)
+
+    def export(self):
+        """
+        Returns what was timed as a dictionary of phase to a dictionary of its
+        'ns' (total), 'count' and 'histogram'
+        """
+        return {phase: {'ns': self.totals[phase], 'count': self.counts[phase],
+            'histogram': list(self.histograms[phase])} for phase in PHASES}
+
+
+def mergeProfiles(profiles):
+    """
+    Adds up exported profiles, for example those of every worker of a training run
+
+    Arguments:
+    profiles - list of dictionaries from StepProfiler.export()
+
+    returns a dictionary in the same form
+    """
+    merged = StepProfiler().export()
+    for profile in profiles:
+        for phase, timing in profile.items():
+            merged[phase]['ns'] += timing['ns']
+            merged[phase]['count'] += timing['count']
+            merged[phase]['histogram'] = [total + count
+                for total, count in zip(merged[phase]['histogram'], timing['histogram'])]
+    return merged
+
+
+def report(profile):
+    """
+    Prints a line per phase of an exported profile, the slowest phase first
+
+    Arguments:
+    profile - dictionary from StepProfiler.export() or mergeProfiles()
+    """
+    total = sum(timing['ns'] for timing in profile.values()) or 1
+    for phase, timing in sorted(profile.items(), key=lambda item: -item[1]['ns']):
+        if not timing['count']:
+            continue
+        print(f"Phase: {phase}; Calls: {timing['count']}; Total: {timing['ns'] / 1e6:.1f} ms; "
+            f"Mean: {timing['ns'] / timing['count'] / 1000:.2f} us; Share: {timing['ns'] / total:.1%}")
@@ -4,23 +4,25 @@ import qsnake
 import complex_snake
 import snake
 import pygame
-import constant
-
-redirection_blocks = None
 
 class QGame(complex_snake.Game):
-    def __init__(self, training=False, watchTraining=False):
-        global redirection_blocks
-        super().__init__(windowWidth=1280, noBoundry=False, assist=False, screen=watchTraining)
-        redirection_blocks = self.redirection_blocks
+    def __init__(self, training=False, watchTraining=False, seed=None, layout=None):
+        """
+        Arguments:
+        layout - (column, row) cells of the redirection blocks, for example from a
+            layout.LayoutLibrary. A new layout is generated if not given.
+        """
+        super().__init__(windowWidth=1280, noBoundry=False, assist=False, screen=watchTraining, seed=seed, layout=layout)
         self.snake = complex_snake.Snake(self)
-        self.current_state = QTable.encodeState(self.snake, self.food)
         self.qTable = QTable(self)
+        self.current_state = self.qTable.encoder.encode(self.snake, self.food)
         self.current_action = self.qTable.chooseAction()
         self.speedOfUpdate = 1.5
         self.pause = False
         self.training = training
         self.watchTraining = watchTraining if training else True
+        self.recorder = None
+        self.profiler = None
         self.initText()
 
     def initText(self):
@@ -65,21 +67,8 @@ class QGame(complex_snake.Game):
                 pygame.display.quit()
                 pygame.display.init()
 
-    def step(self):
-        """
-        Takes a full step into the execution of the algorithm. The snake moves and the text on the screen is updated
-        """
-        action_to_take = self.qTable.chooseAction()
-        self.snake.changeDirection(snake.Direction[action_to_take])
-        self.snake.move()
-        old_state = self.current_state
-        self.current_state = QTable.encodeState(self.snake, self.food)
-        reward = self.snake.getReward(self.current_state)
-        self.qTable.updateQValue(old_state, self.current_state, action_to_take, reward)
-        self.current_action = action_to_take
-
-        if self.watchTraining:
-            self.resetText(reward)
+    # The step of the classic game, so the two (and their profiling) can't drift apart
+    step = qsnake.QGame.step
 
     def resetText(self, reward):
         """
@@ -117,22 +106,20 @@ class QGame(complex_snake.Game):
                 timer = 0
                 self.step()
 
-            self.drawBoard()
-            pygame.display.flip()  # update display
+            if self.profiler:
+                self.profiler.render(self)
+            else:
+                self.drawBoard()
+                pygame.display.flip()  # update display
             timer += self.clock.tick(self.fps) / 1000
 
     def reset(self, learning_rate=None, discount_factor=None, assist=None, noBoundry=None, training=None, newQ=False):
         """
         Resets the game without resetting the Q-Table
         """
-        self.snake = complex_snake.Snake(self)
-        self.score = 0
+        self.restart()
         self.current_action = self.qTable.chooseAction()
-        self.food = complex_snake.Food(self)
-        self.done = False
         self.qTable = QTable(self) if newQ else self.qTable
-        if hasattr(self, "scoreText"):
-            self.scoreText.reset()
         learning = learning_rate if learning_rate != None else self.qTable.learning_rate
         discount_factor = discount_factor if discount_factor != None else self.qTable.discount_factor
         assist = assist if assist != None else self.assist
@@ -144,25 +131,13 @@ class QGame(complex_snake.Game):
         self.qTable.setDiscount(discount_factor)
         self.assist = assist
         self.noBoundry = noBoundry
+        if self.recorder:
+            self.recorder.begin(self)
 
 class QTable(qsnake.QTable):
-    @classmethod
-    def __encodeSurrounding(cls, bmap, minimum_value, snake_obj, bit_start = 0):
-        global redirection_blocks
-        surrounding = cls.__mapSurrounding(snake_obj, minimum_value)
-        encoded_map = bmap
-        # Checks each block in the surrounding and checks if it is near a wall, or near a piece of the tail
-        bit_position=bit_start
-        for (index, (x, y, block)) in enumerate(surrounding):
-            if index % minimum_value == 0 and index != 0:  # Don't increment immediately
-                bit_position += 1
-
-            if (x < snake_obj.game.leftBoundry or y < 0 or x == snake_obj.game.rightBoundry or y == constant.WINDOW_HEIGHT
-                or snake.Block(snake_obj.width, x, y) in redirection_blocks
-                or (block != None and block.colliderect(snake.Block(constant.BLOCK_SIZE, x, y)))
-                and not encoded_map.test(bit_position)):
-
-                encoded_map.set(bit_position)
+    # The redirection blocks are in the game's obstacle mask, so the neighbour
+    # probes of the classic encoder already see them
+    Encoder = qsnake.NeighbourEncoder
 
 def main():
     #qsnake.train(20, QGame, [i for i in range(10, 100, 10)], "complex_train_file.txt")
@@ -1,19 +1,13 @@
 #! /usr/bin/env python3
+import copy
 import snake
 import pygame
 import constant
 import numpy as np
 import pandas as pd
-from random import randint
-import bitmap
-import itertools
-import statistics
-import datetime
-from scipy.stats import describe
-import json
-from queue import Queue
 import multiprocessing
 import os
+import time
 
 
 class QGame(snake.Game):
@@ -23,16 +17,18 @@ class QGame(snake.Game):
     Inherits from snake.Game
     """
 
-    def __init__(self, training=False, watchTraining=False):
-        snake.Game.__init__(self, windowWidth=1280, noBoundry=False, assist=False, screen=watchTraining)
+    def __init__(self, training=False, watchTraining=False, seed=None):
+        snake.Game.__init__(self, windowWidth=1280, noBoundry=False, assist=False, screen=watchTraining, seed=seed)
         self.snake = Snake(self)
-        self.current_state = QTable.encodeState(self.snake, self.food)
         self.qTable = QTable(self)
+        self.current_state = self.qTable.encoder.encode(self.snake, self.food)
         self.current_action = self.qTable.chooseAction()
         self.speedOfUpdate = 1.5
         self.pause = False
         self.training = training
         self.watchTraining = watchTraining if training else True
+        self.recorder = None
+        self.profiler = None
         self.initText()
 
     def initText(self):
@@ -81,17 +77,39 @@ class QGame(snake.Game):
         """
         Takes a full step into the execution of the algorithm. The snake moves and the text on the screen is updated
         """
+        profiler = self.profiler # Times the phases of the step if there is one, see profiler.StepProfiler
+        if profiler:
+            profiler.start()
         action_to_take = self.qTable.chooseAction()
+        if profiler:
+            profiler.lap("chooseAction")
         self.snake.changeDirection(snake.Direction[action_to_take])
+        if profiler:
+            profiler.lap("changeDirection")
         self.snake.move()
+        if profiler:
+            profiler.lap("move")
         old_state = self.current_state
-        self.current_state = QTable.encodeState(self.snake, self.food)
+        self.current_state = self.qTable.encoder.encode(self.snake, self.food)
+        if profiler:
+            profiler.lap("encodeState")
         reward = self.snake.getReward(self.current_state)
+        if profiler:
+            profiler.lap("getReward")
         self.qTable.updateQValue(old_state, self.current_state, action_to_take, reward)
+        if profiler:
+            profiler.lap("updateQValue")
         self.current_action = action_to_take
 
+        if self.recorder:
+            self.recorder.record(self, action_to_take)
+
         if self.watchTraining:
+            if profiler:
+                profiler.start()
             self.resetText(reward)
+            if profiler:
+                profiler.lap("resetText")
 
     def resetText(self, reward):
         """
@@ -129,22 +147,20 @@ class QGame(snake.Game):
                 timer = 0
                 self.step()
 
-            self.drawBoard()
-            pygame.display.flip()  # update display
+            if self.profiler:
+                self.profiler.render(self)
+            else:
+                self.drawBoard()
+                pygame.display.flip()  # update display
             timer += self.clock.tick(self.fps) / 1000
 
     def reset(self, learning_rate=None, discount_factor=None, assist=None, noBoundry=None, training=None, newQ=False):
         """
         Resets the game without resetting the Q-Table
         """
-        self.snake = Snake(self)
-        self.score = 0
+        self.restart()
         self.current_action = self.qTable.chooseAction()
-        self.food = snake.Food(self)
-        self.done = False
         self.qTable = QTable(self) if newQ else self.qTable
-        if hasattr(self, "scoreText"):
-            self.scoreText.reset()
         learning = learning_rate if learning_rate != None else self.qTable.learning_rate
         discount_factor = discount_factor if discount_factor != None else self.qTable.discount_factor
         assist = assist if assist != None else self.assist
@@ -156,6 +172,160 @@ class QGame(snake.Game):
         self.qTable.setDiscount(discount_factor)
         self.assist = assist
         self.noBoundry = noBoundry
+        if self.recorder:
+            self.recorder.begin(self)
+
+class StateEncoder():
+    """
+    Turns the snake and the food into the state used to index the QTable, see
+    QTable.encodeState() for the format. Subclasses decide which of the eight
+    cells around the head are obstacles.
+
+    Public Methods:
+    encode()
+    surroundingBits()
+    headingBits()
+    """
+    DIRECTIONS = {"UP": 0, "LEFT": 1, "DOWN": 2, "RIGHT": 3}
+
+    def __init__(self, game):
+        self.game = game
+
+    def encode(self, snake_obj, food):
+        """
+        Returns the encoded state as a string of 12 bits
+        """
+        return format(self.headingBits(snake_obj, food) | self.surroundingBits(snake_obj), "012b")
+
+    def surroundingBits(self, snake_obj):
+        """
+        Returns the 8 surrounding bits as an int, bit 0 is the top left neighbour
+        and bit 7 the bottom right one
+        """
+        raise NotImplementedError
+
+    def headingBits(self, snake_obj, food):
+        """
+        Returns the quadrant of the food (bits 8-9) and the direction of the snake
+        (bits 10-11) as an int
+        """
+        if food.x > snake_obj.x and food.y <= snake_obj.y:
+            quadrant = 0
+        elif food.x <= snake_obj.x and food.y < snake_obj.y:
+            quadrant = 1
+        elif food.x < snake_obj.x and food.y >= snake_obj.y:
+            quadrant = 2
+        else:
+            quadrant = 3
+        return quadrant << 8 | self.DIRECTIONS.get(snake_obj.getDirection().name, 0) << 10
+
+
+class NeighbourEncoder(StateEncoder):
+    """
+    Encoder probing the eight cells around the head directly.
+
+    A neighbour is blocked if it is a wall or obstacle in the game's obstacle
+    mask, or if a piece of the tail other than its end is on it (the end moves
+    away on the next step). The neighbours are found by adding precomputed
+    offsets to the index of the head, and the tail is looked up in the snake's
+    occupancy counts, so encoding costs the same whatever the length of the tail.
+    """
+    # The eight neighbours in the order of the surrounding bits
+    NEIGHBOURS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+    def __init__(self, game):
+        super().__init__(game)
+        stride = game.gridWidth + 2
+        self.offsets = tuple(dy * stride + dx for dx, dy in self.NEIGHBOURS)
+
+    def surroundingBits(self, snake_obj):
+        game = self.game
+        mask = game.obstacleMask
+        occupancy = snake_obj.occupancy
+        head = game.cellIndex(snake_obj.x, snake_obj.y)
+        end = game.cellIndex(snake_obj.tail[0].x, snake_obj.tail[0].y) if snake_obj.tail else -1
+        bits = 0
+        for bit, offset in enumerate(self.offsets):
+            cell = head + offset
+            # The end of the tail only counts if another piece is on the same cell
+            if mask[cell] or occupancy[cell] > (cell == end):
+                bits |= 1 << bit
+        return bits
+
+
+class IncrementalEncoder(NeighbourEncoder):
+    """
+    Encoder deriving the surrounding bits from the ones of the previous step.
+
+    When the head moved one cell since the last state, most of its new
+    neighbours were already neighbours before, so their bits are shifted over
+    and only the cells entering the neighbourhood are probed. The cells whose
+    occupancy changed with the move (the old head and both ends of the tail)
+    are probed again. Anything else (the first state, a new or restored snake,
+    a new layout, going through a wall, several moves) falls back on the full
+    encoder.
+
+    Instance Variables:
+    check - compare every incremental state against the full encoder and raise
+        a RuntimeError if they differ
+    """
+
+    def __init__(self, game, check=False):
+        super().__init__(game)
+        self.check = check
+        self.last = None
+        # For every move, the (bit, bit before the move, offset) of the neighbours
+        # seen from both heads and the (bit, offset) of the ones to probe
+        self.shifts = {}
+        for mx, my in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+            shifted, probed = [], []
+            for bit, (dx, dy) in enumerate(self.NEIGHBOURS):
+                if (dx + mx, dy + my) in self.NEIGHBOURS:
+                    shifted.append((bit, self.NEIGHBOURS.index((dx + mx, dy + my)), self.offsets[bit]))
+                else:
+                    probed.append((bit, self.offsets[bit]))
+            self.shifts[my * (game.gridWidth + 2) + mx] = (shifted, probed)
+
+    def surroundingBits(self, snake_obj):
+        game = self.game
+        head = game.cellIndex(snake_obj.x, snake_obj.y)
+        end = game.cellIndex(snake_obj.tail[0].x, snake_obj.tail[0].y) if snake_obj.tail else -1
+        last = self.last
+        if (last is None or last[0] is not snake_obj or last[1] is not snake_obj.occupancy
+            or last[2] is not game.obstacleMask or last[3] + 1 != snake_obj.moves
+            or head - last[4] not in self.shifts):
+            bits = super().surroundingBits(snake_obj)
+        else:
+            bits = self.__shiftBits(snake_obj, head, end, last[4], last[5], last[6])
+            if self.check and bits != super().surroundingBits(snake_obj):
+                raise RuntimeError(f"Incremental surrounding {bits:08b} differs from "
+                    f"{super().surroundingBits(snake_obj):08b} after move {snake_obj.moves}")
+
+        self.last = (snake_obj, snake_obj.occupancy, game.obstacleMask, snake_obj.moves, head, end, bits)
+        return bits
+
+    def __shiftBits(self, snake_obj, head, end, old_head, old_end, old_bits):
+        """
+        Computes the surrounding bits of the head from the bits of the previous step
+        """
+        mask = self.game.obstacleMask
+        occupancy = snake_obj.occupancy
+        shifted, probed = self.shifts[head - old_head]
+        bits = 0
+        for bit, old_bit, offset in shifted:
+            cell = head + offset
+            if cell == old_end or cell == end: # Its occupancy changed with the move
+                if mask[cell] or occupancy[cell] > (cell == end):
+                    bits |= 1 << bit
+            elif old_bits >> old_bit & 1:
+                bits |= 1 << bit
+        # The cells that were not neighbours before, including the old head
+        for bit, offset in probed:
+            cell = head + offset
+            if mask[cell] or occupancy[cell] > (cell == end):
+                bits |= 1 << bit
+        return bits
+
 
 class QTable(pd.DataFrame):
     """
@@ -163,29 +333,48 @@ class QTable(pd.DataFrame):
 
     Inherits from pandas.DataFrame
 
+    Instance Variables:
+    encoder - StateEncoder turning the game into the index of the table
+
     Instance Methods:
     addRow()
     getRow()
     chooseAction()
+    cloneFor()
 
     private Methods:
     __getAvailableDirections()
-    __encodeFoodPosition()
-    __encode
 
     Static Methods:
     findIndiciesOfOccurences()
     encodeState()
-    encodeDirection()
     """
 
-    def __init__(self, game, learning_rate=.1, discount_factor=.9, epsilon=0):
+    Encoder = NeighbourEncoder  # Encoder used when none is given
+
+    def __init__(self, game, learning_rate=.1, discount_factor=.9, epsilon=0, encoder=None):
         pd.DataFrame.__init__(self, columns=constant.COLUMNS, dtype=np.float32)
         self.game=game
+        self.encoder = encoder if encoder is not None else self.Encoder(game)
         self.learning_rate=learning_rate
         self.discount_factor=discount_factor
         self.epsilon = epsilon
 
+    def cloneFor(self, game):
+        """
+        Returns a copy of the table, and of its encoder, used by the given game
+        (see snake.Game.clone())
+        """
+        table = type(self).__new__(type(self))
+        pd.DataFrame.__init__(table, self, copy=True)
+        table.game = game
+        table.encoder = copy.copy(self.encoder)
+        table.encoder.game = game
+        table.learning_rate = self.learning_rate
+        table.discount_factor = self.discount_factor
+        table.epsilon = self.epsilon
+        return table
+
     def setLearning(self, value):
         self.learning_rate = value
 
@@ -232,6 +421,7 @@ class QTable(pd.DataFrame):
 
         returns the action for the actor to take by the name value of the Direction enum.
         """
+        randint = self.game.agentRandom.randint
         if randint(0, 10) * .1 < self.epsilon:  # *.1 in order to convert the int to a decimal and 0,10 for 0, 100%
             available_directions=self.__getAvailableDirections()
             next_action=available_directions[randint(
@@ -273,32 +463,6 @@ class QTable(pd.DataFrame):
 
         self.loc[current_state].at[action] = value + self.learning_rate * newValue
 
-    @staticmethod
-    def __mapSurrounding(snake, minimum):
-        """
-        Maps the surrounding of the head of the snake for use in the encodeSate() function. 
-        """
-        tail_placeholder = [i for i in range(0, minimum)] 
-        return [(x, y, block) for x in range(snake.x - snake.width, snake.x + snake.width * 2, snake.width)
-                       for y in range(snake.y - snake.width, snake.y + snake.width * 2, snake.width)
-                       for (block, place) in itertools.zip_longest(snake.tail[1:], tail_placeholder)
-                       if (x, y) != (snake.x, snake.y)]
-
-    @classmethod
-    def __encodeSurrounding(cls, bmap, minimum_value, snake_obj, bit_start = 0):
-        surrounding = cls.__mapSurrounding(snake_obj, minimum_value)
-        encoded_map = bmap
-        # Checks each block in the surrounding and checks if it is near a wall, or near a piece of the tail
-        bit_position=bit_start
-        for (index, (x, y, block)) in enumerate(surrounding):
-            if index % minimum_value == 0 and index != 0:  # Don't increment immediately
-                bit_position += 1
-            if (x < snake_obj.game.leftBoundry or y < 0 or x == snake_obj.game.rightBoundry or y == constant.WINDOW_HEIGHT
-                or (block != None and block.colliderect(snake.Block(constant.BLOCK_SIZE, x, y)))
-                and not encoded_map.test(bit_position)):
-
-                encoded_map.set(bit_position)
-
     @classmethod
     def encodeState(cls, snake_obj, food):
         """
@@ -322,82 +486,15 @@ class QTable(pd.DataFrame):
         1 - Obstacle
         0 - Safe
 
-        returns the encoded string as a bitmap
-        """
-        # Note, in range() the stop parameter is set as x + width * 2 because the end value is not inclusive
-        # Here, we are Getting the 8 blocks surrounding the head (in the order of the encoding) and for each of
-        # the 8 blocks we are attaching every piece of the tail. This will give 8 * len(tail) values to compare.
-        minimum_value = 1 if len(snake_obj.tail) == 0 else len(snake_obj.tail) #To fix mod by 0 error
-
-        #surrounding = QTable.__mapSurrounding(snake_obj, minimum_value)
-
-        # 2 bits for direction, 2 bits for quadrant, one bit each for 8 square locations around snake
-        encoded_map=bitmap.BitMap(12)
-
-        # Checks each block in the surrounding and checks if it is near a wall, or near a piece of the tail
-        #bit_position=0
-        #for (index, (x, y, block)) in enumerate(surrounding):
-        #    if index % minimum_value == 0 and index != 0:  # Don't increment immediately
-        #        bit_position += 1
-        #    if (x < snake_obj.game.leftBoundry or y < 0 or x == snake_obj.game.rightBoundry or y == constant.WINDOW_HEIGHT
-        #        or (block != None and block.colliderect(snake.Block(constant.BLOCK_SIZE, x, y)))
-        #        and not encoded_map.test(bit_position)):
-
-        #        encoded_map.set(bit_position)
-        cls.__encodeSurrounding(encoded_map, minimum_value, snake_obj)
+        Walls, obstacles and the tail (other than its end) count as obstacles.
 
-        bit_position = 7
-        QTable.__encodeFoodPosition(snake_obj, food, encoded_map, bit_position+1)
-        QTable.__encodeDirection(snake_obj, encoded_map, bit_position+3)
-
-        return encoded_map.tostring()[4:] #We only need 12 bits, not 16
-
-    @staticmethod
-    def __encodeFoodPosition(snake, food, bitmap, start_bit):
+        returns the encoded state as a string of 12 bits
         """
-        Encodes the position of the food into the bitmap
-
-        Arguments:
-        snake - Snake object
-        food - Food object
-        bitmap - Bitmap of surrounding
-
-        Helper function for encodeState()
-        """
-        if food.x > snake.x and food.y <= snake.y:
-            pass  # 00 is for top right
-        elif food.x <= snake.x and food.y < snake.y:
-            bitmap.set(start_bit)
-        elif food.x < snake.x and food.y >= snake.y:
-            bitmap.set(start_bit+1)
-        else:
-            bitmap.set(start_bit)
-            bitmap.set(start_bit+1)
-
-    @staticmethod
-    def __encodeDirection(snake, bitmap, start_bit):
-        """
-        Encodes the direction of the snake into the bitmap
-
-        Arguments:
-        snake - Snake object
-        bitmap - Bitmap of surrounding
-        
-        Helper function for encodeState()
-        """
-        if snake.getDirection().name == "UP":
-            pass #00 for up
-        elif snake.getDirection().name == "LEFT":
-            bitmap.set(start_bit)
-        elif snake.getDirection().name == "DOWN":
-            bitmap.set(start_bit+1)
-        elif snake.getDirection().name == "RIGHT":
-            bitmap.set(start_bit)
-            bitmap.set(start_bit+1)
+        return cls.Encoder(snake_obj.game).encode(snake_obj, food)
 
 class Snake(snake.Snake):
-    def __init__(self, game):
-        snake.Snake.__init__(self, game)
+    def reset(self):
+        snake.Snake.reset(self)
         self.last_length=0
         self.last_distance = self.distanceToFood()
 
@@ -423,16 +520,116 @@ class Snake(snake.Snake):
 
         return reward
 
-    def die(self):
+    def getFlags(self):
+        return snake.Snake.getFlags(self) + (self.last_length, self.last_distance)
+
+    def setFlags(self, flags):
+        *flags, self.last_length, self.last_distance = flags
+        snake.Snake.setFlags(self, flags)
+
+    def die(self, reason):
         """
         Print the QTable upon death
         """
         self.game.done = True
+        self.game.deathReason = reason
         if self.game.watchTraining:
             print(f"Final score = {self.game.score}")
             print(self.game.qTable)
 
-def experiment(game_type, replications, trials):
+def benchmarkEncoder(tail_lengths=(1, 50, 200), repeats=2000, encoders=None):
+    """
+    Times encoding a state with tails of increasing length. The head walks back
+    and forth along the bottom row so the incremental encoder sees real moves.
+
+    Arguments:
+    tail_lengths - lengths of the tails to test
+    repeats - number of states encoded per length
+    encoders - StateEncoder classes to compare (default NeighbourEncoder and IncrementalEncoder)
+
+    returns a list of dictionaries, one per length and encoder
+    """
+    encoders = encoders if encoders is not None else [NeighbourEncoder, IncrementalEncoder]
+    game = QGame(seed=0)
+    snake_obj = game.snake
+    results = []
+    for length in tail_lengths:
+        # Lay the tail out row by row from the top left corner
+        snake_obj.tail = [snake.Block(game.size, game.leftBoundry + index % game.gridWidth * game.size,
+            index // game.gridWidth * game.size) for index in range(length)]
+        snake_obj.countOccupancy()
+        for encoder_type in encoders:
+            encoder = encoder_type(game)
+            snake_obj.x, snake_obj.y = game.leftBoundry, game.gameHeight - game.size
+            start = time.perf_counter()
+            for repeat in range(repeats):
+                snake_obj.moves += 1
+                snake_obj.x += game.size if repeat // (game.gridWidth - 1) % 2 == 0 else -game.size
+                encoder.encode(snake_obj, game.food)
+            seconds = (time.perf_counter() - start) / repeats
+            results.append({'tail': length, 'encoder': encoder_type.__name__, 'us': seconds * 1e6})
+            print(f"Tail: {length}; Encoder: {encoder_type.__name__}; Encoding: {seconds * 1e6:.2f} us")
+    return results
+
+def replicationSeed(seed, replication):
+    """
+    Returns the SeedSequence a replication of an experiment is played with
+
+    Arguments:
+    seed - SeedSequence of the experiment
+    replication - index of the replication
+    """
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (replication,),
+        pool_size=seed.pool_size)
+
+def runReplication(game, trials, seed, monitor=None):
+    """
+    Trains a fresh QTable for the number of trials and plays one more game to score it.
+
+    Argument List:
+    game - the game to play, it is reset before training
+    trials - Number of trials to train for
+    seed - SeedSequence to reseed the game's random generators with
+    monitor (optional) - telemetry.WorkerMonitor to count every game with
+
+    returns the score of the final game
+    """
+    game.reset(newQ=True, learning_rate=.9)
+    # Reseeded after the reset, which still draws from the old QTable, and started
+    # again so nothing the game was used for before carries over
+    game.reseed(seed)
+    game.restart()
+    if game.recorder: # The episode reset() began has the old random stream and food
+        game.recorder.begin(game)
+    game.current_state = game.qTable.encoder.encode(game.snake, game.food)
+    game.current_action = game.qTable.chooseAction()
+    for trial in range(0, trials):
+        game.play()
+        if monitor:
+            monitor.episode(trial)
+        game.reset()
+    game.play()
+    if monitor:
+        monitor.episode(trials)
+    return game.score
+
+def runExperiment(game, replications, trials, seed, monitor=None):
+    """
+    Plays every replication of an experiment on the given game
+
+    Argument List:
+    game - the game to play, already laid out for the experiment
+    replications - Number of replications
+    trials - Number of trials per replication
+    seed - SeedSequence of the experiment, every replication gets its own child
+    monitor (optional) - telemetry.WorkerMonitor to count every game with
+
+    returns list of scores; len(list) == replications
+    """
+    return [runReplication(game, trials, replicationSeed(seed, replication), monitor)
+        for replication in range(0, replications)]
+
+def experiment(game_type, replications, trials, seed=None):
     """
     Train the snake over different trial counts; each trial count is replicated multiple times.
 
@@ -440,22 +637,94 @@ def experiment(game_type, replications, trials):
     game_type - The type of the game object to be called
     replications - Number of replications
     trials - Number of trials per replication
+    seed - SeedSequence (or int) of the experiment, every replication gets its own child
 
     returns list of scores; len(list) == replications
     """
-    final_scores = []
-    game = game_type(training=True, watchTraining=False)
-    for replication in range(0, replications):
-        game.reset(newQ=True, learning_rate=.9)
-        for trial in range(0, trials):
-            game.play()
-            game.reset()
-        game.play()
-        final_scores += [game.score]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    game = game_type(training=True, watchTraining=False, seed=seed)
+    return runExperiment(game, replications, trials, seed)
+
+worker_game = None
+worker_monitor = None
+worker_telemetry = {}
+
+def initWorker(game_type, profile=False, queue=None):
+    """
+    Pool initializer of train(): builds the game (and its QTable) that every task
+    of the worker is played on
+
+    Argument List:
+    game_type - the type of the game object
+    profile - time the phases of every step with a profiler.StepProfiler
+    queue - multiprocessing.Queue to send live telemetry to (see telemetry.WorkerMonitor)
+    """
+    global worker_game, worker_monitor
+    start = time.perf_counter()
+    worker_game = game_type(training=True, watchTraining=False)
+    if profile:
+        import profiler
+        profiler.StepProfiler().attach(worker_game)
+    if queue is not None:
+        import telemetry
+        worker_monitor = telemetry.WorkerMonitor(queue, worker_game)
+    worker_telemetry.update(pid=os.getpid(), init_seconds=time.perf_counter() - start, tasks=0)
+
+def workerExperiment(replications, trials, seed):
+    """
+    experiment() for the workers of train(), played on the worker's game. The game
+    is reseeded and laid out again so the scores are the same as experiment()'s.
 
-    return final_scores
+    returns (list of scores, dictionary of telemetry of the task). When profiling,
+    the telemetry has the 'profile' of the task's steps (see profiler.StepProfiler.export())
+    """
+    start = time.perf_counter()
+    worker_game.reseed(seed)
+    worker_game.newBoard()
+    setup = time.perf_counter() - start
+    moves = worker_game.snake.moves
+    if worker_monitor:
+        worker_monitor.beginTask(trials, replications)
+
+    final_scores = runExperiment(worker_game, replications, trials, seed, worker_monitor)
+    if worker_monitor:
+        worker_monitor.push()
+
+    worker_telemetry['tasks'] += 1
+    task_telemetry = {
+        'pid': worker_telemetry['pid'],
+        'trials': trials,
+        'steps': worker_game.snake.moves - moves,
+        # The game is only built for the first task of the worker
+        'init_seconds': worker_telemetry['init_seconds'] if worker_telemetry['tasks'] == 1 else 0,
+        'setup_seconds': setup,
+        'run_seconds': time.perf_counter() - start - setup
+    }
+    if worker_game.profiler:
+        task_telemetry['profile'] = worker_game.profiler.export()
+        worker_game.profiler.clear()
+    return final_scores, task_telemetry
+
+def rerun(game_type, trials, seed, trial_index, replication):
+    """
+    Plays a single replication of a train() sweep again, exactly as it was played in the sweep.
+
+    Argument List:
+    game_type - the type of the game object used in the sweep
+    trials - the trial count of the replication
+    seed - the seed of the sweep (stored as "seed" in its records)
+    trial_index - index of the trial count in the sweep's trial set
+    replication - index of the replication
 
-def train(replications, game_type, trial_set, out_file_name=None):
+    returns the final score of the replication
+    """
+    experiment_seed = np.random.SeedSequence(seed, spawn_key=(trial_index,))
+    game = game_type(training=True, watchTraining=False, seed=experiment_seed)
+    return runReplication(game, trials, replicationSeed(experiment_seed, replication))
+
+def train(replications, game_type, trial_set, out_file_name=None, seed=None, profile=False, processes=None,
+    live=False, metrics_file=None, metrics_port=None, database=None, archive=None):
     """
     Trains the snake over the number of replications and the trial set. 
     Example replications = 10, trial_set = [1]
@@ -470,22 +739,67 @@ def train(replications, game_type, trial_set, out_file_name=None):
     trail_set - List of number of games to train
     out_file_name (optional) - File to store results for 
         If not specified, the results are printed to the terminal
+    seed (optional) - Root seed of the sweep, a random one is used if not specified.
+        Every trial count gets its own child seed so results don't depend on
+        which worker runs them. Use rerun() to play a single replication again.
+    profile (optional) - Time the phases of every step in the workers, the
+        phases of all of them are printed at the end
+    processes (optional) - Number of workers, one per core by default
+    live (optional) - Keep a line with the steps/sec, games/sec and scores of the
+        workers on the console while they train
+    metrics_file (optional) - JSON file to keep the live metrics in (see telemetry.TelemetryListener)
+    metrics_port (optional) - Serve the live metrics for Prometheus at
+        http://127.0.0.1:<metrics_port>/metrics while training, 0 for a free port. The
+        address is written to stderr when the server starts (see telemetry.MetricsServer)
+    database (optional) - SQLite file to add the results to as a new run (see store.ResultsStore)
+    archive (optional) - Directory of .npy columns to add the results to as a new run (see store.ScoreArchive)
+
+    returns a list of dictionaries of telemetry, one per trial count (see workerExperiment())
     """
+    # Only needed for the results, kept out of the import of the module (and of every worker)
+    import json
+    from scipy.stats import describe
+
     records = []
+    root_seed = np.random.SeedSequence(seed)
 
     formatted_input = []
-    for trial in trial_set:
-        formatted_input.append((game_type, replications, trial))
+    for index, trial in enumerate(trial_set):
+        formatted_input.append((replications, trial,
+            np.random.SeedSequence(root_seed.entropy, spawn_key=(index,))))
+
+    queue = None
+    server = None
+    if live or metrics_file or metrics_port is not None:
+        import telemetry
+        queue = multiprocessing.Queue()
+        sweep = {}
+        for trials in trial_set:
+            sweep[trials] = sweep.get(trials, 0) + replications
+        listener = telemetry.TelemetryListener(queue, metrics_file=metrics_file, console=live, sweep=sweep)
+        listener.start()
+        if metrics_port is not None:
+            server = telemetry.MetricsServer(listener, metrics_port)
+            server.start()
 
     #with multiprocessing.Pool(processes=8) as pool:
-    with multiprocessing.Pool() as pool:
-        results = pool.starmap(experiment, formatted_input)
-
-    for final_scores, trials in zip(results, trial_set):
+    with multiprocessing.Pool(processes, initializer=initWorker, initargs=(game_type, profile, queue)) as pool:
+        results = pool.starmap(workerExperiment, formatted_input)
+        # pygame catches SIGTERM in the workers, so let them exit instead of terminating them
+        pool.close()
+        pool.join()
+    if queue is not None:
+        listener.stop()
+    if server:
+        server.stop()
+    task_telemetry = [task for _, task in results]
+
+    for (final_scores, _), trials in zip(results, trial_set):
         record = {
             'trials': trials,
             'replications': replications,
-            'final_scores': final_scores
+            'final_scores': final_scores,
+            'seed': root_seed.entropy
         }
         record['final_scores'] = str(record['final_scores'])[1:-1].replace(',', '')
         records += [record]
@@ -511,10 +825,30 @@ def train(replications, game_type, trial_set, out_file_name=None):
             out_file.write("Training: " + str(count + 1) + '\n')
             out_file.write(json.dumps(records, indent=4) + '\n')
 
+    stores = []
+    if database or archive:
+        import store
+        stores = ([store.ResultsStore(database)] if database else []) + ([store.ScoreArchive(archive)] if archive else [])
+    for results_store in stores:
+        run = results_store.addRun(f"{game_type.__module__}.{game_type.__name__}", root_seed.entropy, replications,
+            {'trial_set': list(trial_set), 'processes': processes or os.cpu_count(), 'learning_rate': .9})
+        for (final_scores, _), trials in zip(results, trial_set):
+            results_store.addScores(run, trials, final_scores)
+        results_store.close()
+
     for record in records:
         print(f"Trials: {trials}; Replications: {replications}")
         print(describe([int(x) for x in record['final_scores'] if x != ' ']))
 
+    workers = sum(1 for task in task_telemetry if task['init_seconds'])
+    print(f"Workers: {workers}; Game setup: {sum(task['init_seconds'] for task in task_telemetry):.2f} s; "
+        f"Task setup: {sum(task['setup_seconds'] for task in task_telemetry) * 1000:.1f} ms; "
+        f"Playing: {sum(task['run_seconds'] for task in task_telemetry):.2f} s")
+    if profile:
+        import profiler
+        profiler.report(profiler.mergeProfiles([task['profile'] for task in task_telemetry]))
+    return task_telemetry
+
 def main():
     # 14 cols, 19 rows
     #train(100, QGame, [i for i in range(10, 200 + 10, 10)], "train_file.txt")
@@ -0,0 +1,306 @@
+#! /usr/bin/env python3
+"""
+Records episodes of the Q-Learning games into a compact binary file and
+replays them headlessly (or on screen) for debugging.
+
+An episode is stored as a fixed header followed by the redirection layout
+(one pair of grid cells per block) and the action sequence packed four
+actions to a byte. Several episodes can be appended to the same file.
+
+Usage:
+    python replay.py episodes.snk [-i INDEX] [--render] [--fps FPS]
+"""
+import struct
+import argparse
+import sys
+import os
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide" #Don't show the pygame startup message
+import pygame
+import snake
+import constant
+
+MAGIC = b"SNKE"
+VERSION = 1
+COMPLEX_FLAG = 1
+
+# magic, version, flags, size, windowWidth, gameWidth, gameHeight, seed of the
+# episode's food stream, food column, food row, number of blocks, steps, final score
+HEADER = struct.Struct("<4sBBHHHHQHHHII")
+CELL = struct.Struct("<HH")
+
+
+class Episode():
+    """
+    A single recorded episode
+
+    Instance Variables:
+    complex - True if the episode was played with redirection blocks
+    size, windowWidth, gameWidth, gameHeight - the board the episode was played on
+    seed - seed of the episode's food stream (see snake.Game.seedEpisode())
+    food - (x, y) position of the first food
+    layout - list of (x, y) positions of the redirection blocks
+    actions - list of action names (see constant.COLUMNS)
+    score - final score of the episode
+    """
+
+    def __init__(self, complex, size, windowWidth, gameWidth, gameHeight, seed, food, layout, actions, score):
+        self.complex = complex
+        self.size = size
+        self.windowWidth = windowWidth
+        self.gameWidth = gameWidth
+        self.gameHeight = gameHeight
+        self.seed = seed
+        self.food = food
+        self.layout = layout
+        self.actions = actions
+        self.score = score
+
+    def pack(self):
+        """
+        Returns the episode in its binary form
+        """
+        flags = COMPLEX_FLAG if self.complex else 0
+        out = bytearray(HEADER.pack(MAGIC, VERSION, flags, self.size,
+            self.windowWidth, self.gameWidth, self.gameHeight, self.seed,
+            self.food[0] // self.size, self.food[1] // self.size,
+            len(self.layout), len(self.actions), self.score))
+
+        for x, y in self.layout:
+            out += CELL.pack(x // self.size, y // self.size)
+
+        packed = bytearray((len(self.actions) + 3) // 4)
+        for index, action in enumerate(self.actions):
+            packed[index // 4] |= constant.COLUMNS.index(action) << (index % 4 * 2)
+
+        return bytes(out + packed)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        """
+        Reads an episode from the given bytes
+
+        Arguments:
+        data - bytes holding one or more episodes
+        offset - where the episode starts in data
+
+        returns (episode, offset of the next episode)
+        """
+        (magic, version, flags, size, windowWidth, gameWidth, gameHeight, seed,
+            food_col, food_row, blocks, steps, score) = HEADER.unpack_from(data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} episode at byte {offset}")
+        offset += HEADER.size
+
+        layout = []
+        for i in range(blocks):
+            col, row = CELL.unpack_from(data, offset)
+            layout.append((col * size, row * size))
+            offset += CELL.size
+
+        packed_length = (steps + 3) // 4
+        packed = data[offset:offset + packed_length]
+        actions = [constant.COLUMNS[packed[index // 4] >> (index % 4 * 2) & 3] for index in range(steps)]
+        offset += packed_length
+
+        return cls(bool(flags & COMPLEX_FLAG), size, windowWidth, gameWidth,
+            gameHeight, seed, (food_col * size, food_row * size), layout,
+            actions, score), offset
+
+
+class EpisodeRecorder():
+    """
+    Records every episode played by a QGame and appends it to a file
+
+    Public Methods:
+    attach(game)
+    begin(game)
+    record(game, action)
+    finish(game)
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.episode = None
+
+    def attach(self, game):
+        """
+        Start recording the given game. The current episode is recorded from its
+        current state, later episodes are recorded when the game is reset.
+        """
+        game.recorder = self
+        self.begin(game)
+
+    def begin(self, game):
+        """
+        Starts a new episode. The seed of the episode's food stream is saved, it
+        places the first food and every later one again. The game seeds every
+        episode whether it is recorded or not, so recording doesn't change it.
+        """
+        self.episode = Episode(hasattr(game, "redirection_blocks"), game.size,
+            game.windowWidth, game.gameWidth, game.gameHeight, game.episodeSeed,
+            (game.food.x, game.food.y),
+            [(block.x, block.y) for block in getattr(game, "redirection_blocks", [])],
+            [], 0)
+
+    def record(self, game, action):
+        """
+        Record the action that was just taken, writing the episode out once the game is done
+        """
+        self.episode.actions.append(action)
+        if game.done:
+            self.finish(game)
+
+    def finish(self, game):
+        """
+        Appends the current episode to the file
+        """
+        if self.episode is None:
+            return
+        self.episode.score = game.score
+        with open(self.file_name, "ab") as out_file:
+            out_file.write(self.episode.pack())
+        self.episode = None
+
+
+def readEpisodes(file_name):
+    """
+    Reads every episode stored in the file
+
+    returns a list of Episode objects
+    """
+    with open(file_name, "rb") as in_file:
+        data = in_file.read()
+
+    episodes = []
+    offset = 0
+    while offset < len(data):
+        episode, offset = Episode.unpack(data, offset)
+        episodes.append(episode)
+    return episodes
+
+
+def describeBoard(game):
+    """
+    Returns a picklable description of the board of the game, used to build
+    the same board again (in another process for example) with buildGame()
+    """
+    layout = tuple((block.x, block.y) for block in getattr(game, 'redirection_blocks', []))
+    return (hasattr(game, 'redirection_blocks'), game.size, game.windowWidth,
+        game.gameWidth, game.gameHeight, layout)
+
+
+def buildGame(board, render=False, seed=None):
+    """
+    Builds a headless game on the described board. The snake dies without
+    ending the process.
+
+    Arguments:
+    board - tuple from describeBoard(), its layout None for a random one
+    render - open a window for the game
+    seed - seed of the game's random generators
+
+    returns the game
+    """
+    # Imported here so replaying classic episodes doesn't need the complex game
+    import qsnake
+    import complex_snake
+
+    complex, size, windowWidth, gameWidth, gameHeight, layout = board
+    if complex:
+        game = complex_snake.Game(size, windowHeight=gameHeight, windowWidth=windowWidth,
+            gameHeight=gameHeight, gameWidth=gameWidth, screen=render, seed=seed)
+        if layout is not None:
+            game.setLayout([snake.Block(size, x, y, color=(220, 220, 220))
+                for x, y in layout])
+            game.food.relocate()
+        game.snake = complex_snake.Snake(game)
+    else:
+        game = snake.Game(size, windowHeight=gameHeight, windowWidth=windowWidth,
+            gameHeight=gameHeight, gameWidth=gameWidth, screen=render, seed=seed)
+        game.snake = qsnake.Snake(game)
+    game.watchTraining = False
+    return game
+
+
+def startEpisode(episode, render=False):
+    """
+    Builds a game in the state the episode started in
+
+    Arguments:
+    episode - the Episode to rebuild
+    render - open a window to draw the replay
+
+    returns the game
+    """
+    game = buildGame((episode.complex, episode.size, episode.windowWidth,
+        episode.gameWidth, episode.gameHeight, tuple(episode.layout)), render)
+    # The food is placed from the episode's stream, like at the start of the episode
+    game.random.seed(episode.seed)
+    game.food.relocate()
+    if (game.food.x, game.food.y) != episode.food:
+        raise ValueError(f"The episode's seed places the food at {(game.food.x, game.food.y)}, "
+            f"not at {episode.food} where it was recorded")
+    return game
+
+
+def replay(episode, render=False, fps=10):
+    """
+    Plays the recorded actions back through the rules of the game
+
+    Arguments:
+    episode - the Episode to replay
+    render - draw every step to the screen
+    fps - steps per second when rendering
+
+    returns the game after the last action
+    """
+    game = startEpisode(episode, render)
+    for action in episode.actions:
+        game.snake.changeDirection(snake.Direction[action])
+        game.snake.move()
+        if render:
+            pygame.event.pump()
+            game.drawBoard()
+            pygame.display.flip()
+            game.clock.tick(fps)
+        if game.done:
+            break
+
+    return game
+
+
+def parseArgs():
+    """
+    Parses the command line arguments.
+
+    Returns them as a Namespace object
+    """
+    parser = argparse.ArgumentParser(description="Replay recorded episodes.")
+    parser.add_argument('file_name', help="File written by EpisodeRecorder")
+    parser.add_argument('-index', '-i', type=int, help="Only replay this episode")
+    parser.add_argument('--render', action="store_true")
+    parser.add_argument('--fps', type=int, default=10)
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    if not args.render:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+    episodes = readEpisodes(args.file_name)
+    indexes = [args.index] if args.index is not None else range(len(episodes))
+    mismatches = 0
+    for index in indexes:
+        episode = episodes[index]
+        game = replay(episode, args.render, args.fps)
+        matches = game.score == episode.score and game.done
+        mismatches += not matches
+        print(f"Episode {index}: steps = {len(episode.actions)}; score = {game.score}; "
+            f"recorded score = {episode.score}; {'ok' if matches else 'MISMATCH'}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,68 @@
 #! /usr/bin/env python3
 from enum import Enum
-from random import randint, choice
+from collections import namedtuple
+import random
 from math import floor
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide" #Don't show the pygame startup message
 import pygame
+import numpy as np
 import sys
+import distance
+
+def spawnRandoms(seed_sequence, count):
+    """
+    Creates independent random generators from a numpy SeedSequence.
+
+    The children are derived from the sequence's spawn key instead of
+    SeedSequence.spawn() so the same sequence always gives the same generators.
+
+    Arguments:
+    seed_sequence - numpy.random.SeedSequence to derive from
+    count - number of generators to create
+
+    returns a list of random.Random
+    """
+    randoms = []
+    for index in range(count):
+        child = np.random.SeedSequence(seed_sequence.entropy,
+            spawn_key=seed_sequence.spawn_key + (index,), pool_size=seed_sequence.pool_size)
+        randoms.append(random.Random(int.from_bytes(child.generate_state(4).tobytes(), "little")))
+    return randoms
+
+def copyRandom(generator):
+    """Returns a new random.Random that continues from the state of the given one"""
+    new_generator = random.Random(0)
+    new_generator.setstate(generator.getstate())
+    return new_generator
+
+def copyBlock(block, **attributes):
+    """
+    Returns a shallow copy of a Block (or any subclass) without calling its constructor
+
+    Arguments:
+    block - the Block to copy
+    attributes - instance variables to replace in the copy
+    """
+    new_block = type(block).__new__(type(block))
+    new_block.__dict__.update(block.__dict__)
+    new_block.__dict__.update(attributes)
+    new_block.x, new_block.y, new_block.width, new_block.height = block.x, block.y, block.width, block.height
+    return new_block
+
+GameState = namedtuple("GameState", ["head", "direction", "tail", "food", "score", "done", "reason", "flags"])
+GameState.__doc__ = """
+Immutable, hashable snapshot of the rules state of a game
+
+head - (x, y) of the snake's head
+direction - (dx, dy) of the snake
+tail - tuple of (x, y) of every tail block, oldest first
+food - (x, y) of the food
+score - the score of the game
+done - is the game done
+reason - DeathReason the game ended with
+flags - tuple from Snake.getFlags()
+"""
 
 class Game():
     """Class to create a game of snake 
@@ -14,6 +71,14 @@ class Game():
     userInput()
     play()
     end()
+    snapshot()
+    restore(state)
+    clone()
+    isBlocked(x, y)
+    reseed(seed)
+    seedEpisode()
+    newBoard()
+    restart()
 
     Instance Variables:
     size - the size of the blocks (snake and food)
@@ -22,10 +87,23 @@ class Game():
     scale - determines 
     noBoundry - can the snake go through walls
     done - is the game done
+    deathReason - DeathReason the game ended with, DeathReason.NONE while playing
+    random - random number generator used for food placement and assist, a new
+        one every episode (see seedEpisode())
+    episodeSeed - seed of random for the current episode
+    episodes - number of episodes seeded since the last reseed()
+    layoutRandom - random number generator used to lay out the board
+    agentRandom - random number generator used by whatever is playing the game
+    seedSequence - numpy SeedSequence all the generators are derived from
+    gridWidth, gridHeight - the number of cells across and down the board
+    obstacleMask - bytearray of the board padded with a border of wall cells,
+        non zero cells are blocked (see cellIndex())
+    distanceFields - cache of the distances to the food around the obstacles
     """
 
-    def __init__(self, size=40, fps=60, windowHeight=600, windowWidth=960, gameHeight=600, gameWidth=800, speed=10, noBoundry = False, assist = False, screen=True):
+    def __init__(self, size=40, fps=60, windowHeight=600, windowWidth=960, gameHeight=600, gameWidth=800, speed=10, noBoundry = False, assist = False, screen=True, seed=None):
         pygame.init()
+        self.reseed(seed)
         self.size = size
         self.windowWidth = windowWidth
         self.windowHeight = windowHeight
@@ -37,8 +115,13 @@ class Game():
         # - 1 so the the shape doesn't start at at the edge (meaning the rest of the shape is drawn out of the window)
         self.cols = floor(gameHeight/size - 1)
         self.rows = floor(gameWidth/size - 1)
+        self.gridWidth = gameWidth // size
+        self.gridHeight = gameHeight // size
+        self.obstacleMask = self.createObstacleMask()
+        self.distanceFields = distance.DistanceFields(self)
         self.score = 0
         self.done = False
+        self.deathReason = DeathReason.NONE
         self.text = []
         if screen:
             self.screen = pygame.display.set_mode((windowWidth, windowHeight))
@@ -60,6 +143,163 @@ class Game():
         self.noBoundry = noBoundry
         self.assist = assist
 
+    def reseed(self, seed=None):
+        """
+        Seeds the random generators of the game. Each generator gets its own
+        stream so that, for example, the agent drawing more numbers doesn't change
+        where the food is placed.
+
+        Arguments:
+        seed - int, numpy.random.SeedSequence or None to use fresh entropy
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seedSequence = seed
+        _, self.layoutRandom, self.agentRandom = spawnRandoms(seed, 3)
+        self.episodes = 0
+        self.seedEpisode()
+
+    def seedEpisode(self):
+        """
+        Gives the episode that is starting its own food stream, seeded from the
+        next child of the food stream's SeedSequence. Every episode is seeded
+        the same way whether it is recorded or not, and its seed is all a
+        recording needs to place the food again.
+        """
+        sequence = self.seedSequence
+        child = np.random.SeedSequence(sequence.entropy,
+            spawn_key=sequence.spawn_key + (0, self.episodes), pool_size=sequence.pool_size)
+        self.episodeSeed = int.from_bytes(child.generate_state(2).tobytes(), "little")
+        self.random = random.Random(self.episodeSeed)
+        self.episodes += 1
+
+    def restart(self):
+        """
+        Starts a new game on the same board without building new objects. The
+        snake goes back to the start and the food is placed again, from the
+        new episode's food stream.
+        """
+        self.snake.reset()
+        self.seedEpisode()
+        self.food.relocate()
+        self.score = 0
+        self.done = False
+        self.deathReason = DeathReason.NONE
+        if hasattr(self, 'scoreText'):
+            self.scoreText.reset()
+
+    def newBoard(self):
+        """
+        Lays the board out again from layoutRandom, used to reuse a game for a
+        new experiment after reseed(). The classic board has nothing to lay out.
+        """
+
+    def createObstacleMask(self, blocks=()):
+        """
+        Returns a new obstacle mask: the board with a one cell border of walls
+        around it, plus the given blocks
+
+        Arguments:
+        blocks - Blocks on the board that the snake can't go through
+        """
+        stride = self.gridWidth + 2
+        mask = bytearray(b"\x01" * stride + (b"\x01" + b"\x00" * self.gridWidth + b"\x01") * self.gridHeight
+            + b"\x01" * stride)
+        for block in blocks:
+            mask[self.cellIndex(block.x, block.y)] = 1
+        return mask
+
+    def cellIndex(self, x, y):
+        """
+        Returns the index in the obstacle mask of the cell at the given position.
+        Positions up to one cell outside of the board map onto the border.
+        """
+        return (y // self.size + 1) * (self.gridWidth + 2) + (x - self.leftBoundry) // self.size + 1
+
+    def isBlocked(self, x, y):
+        """
+        Returns True if the cell at the given position is a wall or an obstacle. O(1)
+        """
+        return self.obstacleMask[self.cellIndex(x, y)] != 0
+
+    def cellOf(self, x, y):
+        """Returns the (column, row) of the cell at the given position"""
+        return (x - self.leftBoundry) // self.size, y // self.size
+
+    def snapshot(self):
+        """
+        Returns the state of the snake, food and score as a GameState. The random
+        generators are not part of the snapshot.
+
+        O(len(tail))
+        """
+        return GameState((self.snake.x, self.snake.y), (self.snake.dx, self.snake.dy),
+            tuple((block.x, block.y) for block in self.snake.tail),
+            (self.food.x, self.food.y), self.score, self.done, self.deathReason, self.snake.getFlags())
+
+    def restore(self, state):
+        """
+        Puts the game back into the given GameState
+
+        O(len(tail))
+
+        Arguments:
+        state - GameState from snapshot()
+        """
+        self.snake.x, self.snake.y = state.head
+        self.snake.dx, self.snake.dy = state.direction
+        self.snake.tail = [Block(self.size, x, y) for x, y in state.tail]
+        if self.snake.tail:
+            self.snake.tail[0].color = (255, 250, 205)
+        self.snake.countOccupancy()
+        self.snake.setFlags(state.flags)
+        self.food.moveTo(*state.food)
+        self.score = state.score
+        self.done = state.done
+        self.deathReason = state.reason
+        if hasattr(self, 'scoreText'):
+            self.scoreText.reset()
+            self.scoreText.changeScore(self.score)
+
+    def clone(self, seed=None):
+        """
+        Returns a headless copy of the game that can be played without changing this one.
+        The copy shares the font, clock and the (read only) board layout but has no
+        screen, no text, no recorder and no profiler. A Q-Learning game's copy gets
+        its own copy of the QTable.
+
+        O(len(tail)), plus the size of the QTable if there is one
+
+        Arguments:
+        seed - seed the copy is reseeded with (see reseed()), giving it its own
+            streams. If not given the copy continues this game's streams, so it
+            places food exactly where this game would.
+        """
+        game = object.__new__(type(self))
+        game.__dict__.update(self.__dict__)
+        game.screen = None
+        game.watchTraining = False
+        game.text = []
+        game.__dict__.pop('scoreText', None)
+        if hasattr(game, 'recorder'):
+            game.recorder = None
+        if hasattr(game, 'profiler'):
+            game.profiler = None
+        if getattr(game, 'qTable', None) is not None:
+            game.qTable = game.qTable.cloneFor(game) # Playing the copy mustn't train this game's table
+
+        if seed is None:
+            game.random = copyRandom(self.random)
+            game.agentRandom = copyRandom(self.agentRandom)
+            game.layoutRandom = copyRandom(self.layoutRandom)
+        else:
+            game.reseed(seed)
+
+        game.snake = copyBlock(self.snake, game=game, tail=list(self.snake.tail),
+            occupancy=bytearray(self.snake.occupancy))
+        game.food = copyBlock(self.food, game=game)
+        return game
+
     def userInput(self, key):
         """
         Converts key press into action
@@ -80,7 +320,7 @@ class Game():
         elif key == pygame.K_RIGHT or key == pygame.K_d:
             self.snake.changeDirection(Direction.RIGHT)
         elif key == pygame.K_j:
-            self.snake.die()
+            self.snake.die(DeathReason.QUIT)
         elif key == pygame.K_p:
             self.speed = 0
         elif key == pygame.K_o:
@@ -162,6 +402,18 @@ class Direction(Enum):
         return Direction(list(map(lambda x: -x, self.value)))
 
 
+class DeathReason(Enum):
+    """
+    Enumeration for why a game ended
+    """
+    NONE = 0  # Still playing
+    WALL = 1
+    SELF = 2
+    REDIRECT = 3  # Ran into a redirection block
+    TRAPPED = 4  # Assist found no safe direction
+    QUIT = 5
+
+
 class Block(pygame.Rect):
 
     """
@@ -237,7 +489,11 @@ class Food(Block):
 
     Public Methods:
     relocate()
+    moveTo(x, y)
     isSafe(rect)
+
+    Instance Variables:
+    distanceField - distances from every cell to the food (see distance.DistanceFields)
     """
 
     def __init__(self, game):
@@ -247,12 +503,19 @@ class Food(Block):
 
     def relocate(self):
         """Move the food to a random spot in the grid"""
-        self.x, self.y = randint(self.game.leftBoundry/self.game.size, self.game.rows), randint(0, self.game.cols)
+        self.x, self.y = self.game.random.randint(self.game.leftBoundry/self.game.size, self.game.rows), self.game.random.randint(0, self.game.cols)
         self.x *= self.game.size
         self.y *= self.game.size
 
         if not self.isSafe():
             self.relocate()
+        else:
+            self.distanceField = self.game.distanceFields.field(self.x, self.y)
+
+    def moveTo(self, x, y):
+        """Place the food at the given position"""
+        self.x, self.y = x, y
+        self.distanceField = self.game.distanceFields.field(x, y)
 
     def isSafe(self):
         """
@@ -278,19 +541,45 @@ class Snake(Block):
     checkEat()
     hitWall()
     hitSelf()
-    die()
+    die(reason)
+    safeMoves()
+    safeDirections()
+    assist()
+    reset()
+    getFlags()
+    setFlags(flags)
+    occupy(block)
+    vacate(block)
+    countOccupancy()
 
     Instance Variables:
     color - the Color of the snake head (green)
+    occupancy - bytearray counting the pieces of the tail on every cell,
+        indexed like Game.obstacleMask
+    moves - number of times move() was called
     """
+    # Order of the directions in the mask of safeMoves(), the same as the state encoders'
+    MOVES = (Direction.UP, Direction.LEFT, Direction.DOWN, Direction.RIGHT)
+    MOVE_STEPS = tuple(tuple(direction.value) for direction in MOVES)
+
     def __init__(self, game):
-        super().__init__(game.size, floor(game.rows + game.leftBoundry/game.size/2) *
-                       game.size, floor(game.cols/2) * game.size, (124, 252, 0))
+        super().__init__(game.size, 0, 0, (124, 252, 0))
         self.game = game
+        self.moves = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Puts the snake back on its starting cell, heading up without a tail
+        """
+        self.x = floor(self.game.rows + self.game.leftBoundry/self.game.size/2) * self.game.size
+        self.y = floor(self.game.cols/2) * self.game.size
         self.dx = 0
         self.dy = 0
         self.changeDirection(Direction.UP)
         self.tail = []
+        # A new bytearray rather than clearing it, encoders use it to notice a new snake
+        self.occupancy = bytearray(len(self.game.obstacleMask))
         self.hit_wall = False
         self.hit_self = False
 
@@ -305,6 +594,7 @@ class Snake(Block):
         if newBlock.colliderect(self.game.food):
             self.game.food.relocate()
             self.tail.append(newBlock)
+            self.occupy(newBlock)
             self.game.score += 1
             if hasattr(self.game, 'scoreText'):
                 self.game.scoreText.changeScore(1)
@@ -336,12 +626,14 @@ class Snake(Block):
 
         self.hit_self = False
         self.hit_wall = False
+        self.moves += 1
 
         if self.tail:
-            self.tail = self.tail[1:]
+            self.vacate(self.tail[0])
+            del self.tail[0]
             self.tail.append(Block(self.game.size, self.x, self.y))
-            for block in self.tail[1:]:
-                block.resetColor()
+            self.occupy(self.tail[-1])
+            # Only the end of the tail is coloured, the rest keep the colour they were made with
             self.tail[0].color = (255, 250, 205)
 
         newY = self.dy + self.y
@@ -355,7 +647,7 @@ class Snake(Block):
             elif self.game.assist:
                 self.assist()
             else:
-                self.die()
+                self.die(DeathReason.WALL)
             return
 
         if not self.checkEat(newX, newY):  # Only check if the snake hits itself if it didn't eat, eating causes another block to be placed exactly where the snake is
@@ -364,80 +656,91 @@ class Snake(Block):
                 if self.game.assist:
                     self.assist()
                 else:
-                    self.die()
+                    self.die(DeathReason.SELF)
                 self.hit_self = False
                 return #Don't update the snake if bad move
 
         self.y = newY
         self.x = newX
 
+    def getFlags(self):
+        """
+        Returns the instance variables (other than position and tail) that a
+        GameState has to keep, as a tuple
+        """
+        return (self.hit_wall, self.hit_self)
+
+    def setFlags(self, flags):
+        """Sets the instance variables returned by getFlags()"""
+        self.hit_wall, self.hit_self = flags
+
+    def occupy(self, block):
+        """Counts a piece of the tail that was added on the block's cell"""
+        self.occupancy[self.game.cellIndex(block.x, block.y)] += 1
+
+    def vacate(self, block):
+        """Counts a piece of the tail that was removed from the block's cell"""
+        self.occupancy[self.game.cellIndex(block.x, block.y)] -= 1
+
+    def countOccupancy(self):
+        """Recounts the occupancy from the tail, needed after replacing the tail. O(len(tail))"""
+        self.occupancy = bytearray(len(self.game.obstacleMask))
+        for block in self.tail:
+            self.occupy(block)
+
     def hitWall(self, newX, newY):
         """Check if the snake hit the wall"""
         if newX < self.game.leftBoundry or newY < 0 or newX > self.game.rightBoundry - self.game.size or newY > self.game.gameHeight - self.game.size:  # hit edge of screen
             self.hit_wall = True
 
     def hitSelf(self, newX, newY):
-        """Check if the snake head hit part of it's tail"""
-        newBlock = Block(self.width, newX, newY)
-        for block in self.tail:
-            if newBlock.colliderect(block):
-                self.hit_self = True
-                return
-
-    def die(self):
-        """Kill the snake, end the game"""
-        self.game.done = True
-        print("You have died! Game Over")
-        print(f"Final score = {self.game.score}")
-        exit()
+        """Check if the snake head hit part of it's tail. O(1)"""
+        if self.occupancy[self.game.cellIndex(newX, newY)]:
+            self.hit_self = True
 
-    def safeDirections(self, walls, tail):
+    def die(self, reason):
         """
-        Returns a list of the safe directions that the snake can go at the given spot. 
-        """
-        safe = [Direction.UP, Direction.DOWN, Direction.LEFT, Direction.RIGHT]
-        safe.remove(Direction(self.getDirection())) # remove the unsafe direction
-
-        if self.game.assist or tail:
-            self.checkCollideWithTail(safe)
-
-        if not self.game.noBoundry or walls: #Check walls if they can kill you
-            self.checkCollideWithWall(safe)
+        Kill the snake, end the game. The game is left in its final state and can
+        be started again with Game.restart().
 
-        return safe
-
-    def checkCollideWithWall(self, directions):
+        Arguments:
+        reason - the DeathReason
         """
-        Checks if the directions in the given list would cause a collision with a wall
+        self.game.done = True
+        self.game.deathReason = reason
+        if self.game.screen is not None:
+            print("You have died! Game Over")
+            print(f"Final score = {self.game.score}")
 
-        Arguments:
-        list - a list of directions
+    def safeMoves(self):
         """
-        for item in directions:
-            if (self.x + item.value[0] * self.width < self.game.leftBoundry or
-                self.y + item.value[1] * self.width == 0 or self.x + item.value[0] >
-                self.game.rightBoundry - self.game.size or self.y + item.value[1] >
-                self.game.gameHeight - self.game.size
-                ):
-                directions.remove(item)
-                break
+        Finds the directions the head can move in without hitting a wall, an
+        obstacle or the tail, from the obstacle mask and the occupancy. Without
+        boundaries a move off the board is safe if the cell it wraps around to is.
+        O(1)
 
-    def checkCollideWithTail(self, directions):
+        returns a 4 bit mask, bit i is set if MOVES[i] is safe
         """
-        Checks if the given direction would cause a collision with the tailof the snake
+        width, height = self.game.gridWidth, self.game.gridHeight
+        stride = width + 2
+        column, row = self.game.cellOf(self.x, self.y)
+        mask = self.game.obstacleMask
+        safe = 0
+        for bit, (dx, dy) in enumerate(self.MOVE_STEPS):
+            if self.game.noBoundry:
+                cell = ((row + dy) % height + 1) * stride + (column + dx) % width + 1
+            else:
+                cell = (row + dy + 1) * stride + column + dx + 1
+            if not mask[cell] and not self.occupancy[cell]:
+                safe |= 1 << bit
+        return safe
 
-        Keyword Arguments: 
-        list - a list of the current safe directions, will update the list in place
+    def safeDirections(self):
         """
-        dx, dy = map(lambda x: x * self.width, self.getDirection().value)
-        cur_block = Block(self.width, self.x + dx, self.y + dy)
-        for block in self.tail:
-            for item in directions:
-                dx, dy = map(lambda x: x * self.width, item.value)
-                if Block(self.game.size, cur_block.x + dx,
-                    cur_block.y + dy).colliderect(block):
-                    directions.remove(item)
-                    break
+        Returns a list of the safe directions that the snake can go at the given spot.
+        """
+        safe = self.safeMoves()
+        return [direction for bit, direction in enumerate(self.MOVES) if safe >> bit & 1]
 
     def __goThroughWall(self, newX, newY):
         """
@@ -455,16 +758,28 @@ class Snake(Block):
             raise RunTimeError("Position invalid")
             
 
-    def assist(self, walls = False, tail = False):
+    def assist(self):
         """
-        Assist the snake if it hits itself. Causes the snake to instead choose a random, safe direction to turn.
+        Assist the snake if it is about to hit a wall or itself. Causes the snake to
+        instead choose a random, safe direction to turn and finishes the move in it.
         """
-        safeDirections = self.safeDirections(walls, tail)
-        if safeDirections:
-            self.changeDirection(choice(safeDirections), avoidFlip=False)
-            self.move()
-        else:
-            self.die()
+        safeDirections = self.safeDirections()
+        if not safeDirections:
+            self.die(DeathReason.TRAPPED)
+            return
+
+        self.changeDirection(self.game.random.choice(safeDirections), avoidFlip=False)
+        self.hit_wall = False
+        self.hit_self = False
+        newX, newY = self.x + self.dx, self.y + self.dy
+        self.hitWall(newX, newY)
+        if self.hit_wall: # Only safe because there is no boundry
+            self.hit_wall = False
+            self.__goThroughWall(newX, newY)
+            self.checkEat(self.x, self.y)
+            return
+        self.checkEat(newX, newY)
+        self.x, self.y = newX, newY
 
     def distanceToFood(self):
         """
@@ -476,6 +791,18 @@ class Snake(Block):
         y = abs(self.y - self.game.food.y)
         return x + y
 
+    def pathDistanceToFood(self):
+        """
+        Looks up the number of moves from the head of the snake to the food going
+        around the walls and obstacles (but not the tail)
+
+        returns that number of moves, -1 if the food can't be reached
+        """
+        column, row = self.game.cellOf(self.x, self.y)
+        if not (0 <= column < self.game.gridWidth and 0 <= row < self.game.gridHeight):
+            return -1
+        return int(self.game.food.distanceField[row, column])
+
 
 def main():
     """
@@ -0,0 +1,437 @@
+#! /usr/bin/env python3
+"""
+Stores of the results of qsnake.train() sweeps: a SQLite database for
+queries and a directory of .npy columns (see ScoreArchive) for bulk analysis.
+
+The database has three tables:
+
+runs - one row per sweep: the game, its root seed and the number of replications
+configs - the rest of the settings of a run as (run, key, value)
+scores - the final score of every replication, by run and trial count
+
+The aggregates graph.py plots (means and confidence intervals per trial count,
+comparisons of runs) are computed by SQLite, so only one row per trial count
+is read whatever the number of runs and replications.
+
+Usage:
+    python store.py import train_file.txt [-database results.db | -archive DIR] [-game qsnake.QGame]
+    python store.py runs [-database results.db | -archive DIR]
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import time
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created TEXT NOT NULL,
+    game TEXT NOT NULL,
+    seed TEXT,
+    replications INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS configs (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (run_id, key)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    trials INTEGER NOT NULL,
+    replication INTEGER NOT NULL,
+    score INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_by_run ON scores (run_id, trials);
+CREATE INDEX IF NOT EXISTS scores_by_trials ON scores (trials);
+CREATE INDEX IF NOT EXISTS runs_by_game ON runs (game);
+"""
+
+# Mean, sample variance and confidence interval of the scores of every trial count of a run
+STATISTICS = """
+WITH stats AS (
+    SELECT trials, COUNT(*) AS n, AVG(score) AS mean,
+        (SUM(score * score) - SUM(score) * SUM(score) * 1.0 / COUNT(*)) / (COUNT(*) - 1) AS variance
+    FROM scores WHERE run_id = :run GROUP BY trials
+)
+SELECT trials, n, mean, variance,
+    mean - t_ppf(:confidence, n - 1) * sqrt(variance / n) AS low,
+    mean + t_ppf(:confidence, n - 1) * sqrt(variance / n) AS high
+FROM stats
+"""
+
+
+def tQuantile(confidence, degrees):
+    """
+    Returns the two sided quantile of Student's t distribution for the confidence,
+    None if there are no degrees of freedom
+    """
+    if not degrees:
+        return None
+    from scipy.stats import t
+    return float(t.ppf((1 + confidence) / 2, degrees))
+
+
+def squareRoot(value):
+    """sqrt() for SQLite, None for missing or negative (rounding) values"""
+    return math.sqrt(value) if value is not None and value >= 0 else None
+
+
+class ResultsStore():
+    """
+    A SQLite database of training results
+
+    Public Methods:
+    addRun(game, seed, replications, config)
+    addScores(run, trials, scores)
+    runs(game)
+    latestRun(game)
+    config(run)
+    scores(run, trials)
+    trialStatistics(run, confidence, within_interval)
+    compareRuns(run, other, confidence)
+    importTrainFile(file_name, game)
+    close()
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.create_function("sqrt", 1, squareRoot, deterministic=True)
+        self.connection.create_function("t_ppf", 2, tQuantile, deterministic=True)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def addRun(self, game, seed, replications, config=None):
+        """
+        Adds a run without scores
+
+        Arguments:
+        game - name of the game type, like "qsnake.QGame"
+        seed - root seed of the sweep
+        replications - replications of every trial count
+        config - dictionary of the other settings, values are stored as JSON
+
+        returns the id of the run
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (created, game, seed, replications) VALUES (?, ?, ?, ?)",
+                (time.strftime("%Y-%m-%dT%H:%M:%S"), game, None if seed is None else str(seed), replications))
+            run = cursor.lastrowid
+            self.connection.executemany("INSERT INTO configs (run_id, key, value) VALUES (?, ?, ?)",
+                [(run, key, json.dumps(value)) for key, value in (config or {}).items()])
+        return run
+
+    def addScores(self, run, trials, scores):
+        """
+        Adds the final scores of the replications of a trial count
+
+        Arguments:
+        run - id of the run
+        trials - the trial count
+        scores - list of final scores, one per replication
+        """
+        with self.connection:
+            self.connection.executemany("INSERT INTO scores (run_id, trials, replication, score) VALUES (?, ?, ?, ?)",
+                [(run, trials, replication, int(score)) for replication, score in enumerate(scores)])
+
+    def runs(self, game=None):
+        """
+        Returns the runs, oldest first, as a list of sqlite3.Row of id, created,
+        game, seed, replications and the number of trial counts
+        """
+        return self.connection.execute("""
+            SELECT runs.*, (SELECT COUNT(DISTINCT trials) FROM scores WHERE run_id = runs.id) AS trial_counts
+            FROM runs WHERE :game IS NULL OR game = :game ORDER BY id""", {'game': game}).fetchall()
+
+    def latestRun(self, game=None):
+        """Returns the id of the newest run (of the game), None if there isn't one"""
+        row = self.connection.execute("SELECT MAX(id) FROM runs WHERE :game IS NULL OR game = :game",
+            {'game': game}).fetchone()
+        return row[0]
+
+    def config(self, run):
+        """Returns the settings of a run as a dictionary"""
+        return {key: json.loads(value) for key, value in
+            self.connection.execute("SELECT key, value FROM configs WHERE run_id = ?", (run,))}
+
+    def scores(self, run, trials):
+        """Returns the final scores of a trial count of a run, by replication"""
+        return [row[0] for row in self.connection.execute(
+            "SELECT score FROM scores WHERE run_id = ? AND trials = ? ORDER BY replication", (run, trials))]
+
+    def trialStatistics(self, run, confidence=.95, within_interval=False):
+        """
+        Computes the statistics of the scores of every trial count of a run
+
+        Arguments:
+        run - id of the run
+        confidence - confidence of the intervals
+        within_interval - only count the scores inside the confidence interval of their trial count
+
+        returns a list of sqlite3.Row of trials, n, mean, variance, low and high, by trial count
+        """
+        if not within_interval:
+            return self.connection.execute(STATISTICS + " ORDER BY trials",
+                {'run': run, 'confidence': confidence}).fetchall()
+        return self.connection.execute(f"""
+            WITH bounds AS ({STATISTICS}),
+            kept AS (
+                SELECT scores.trials, scores.score FROM scores JOIN bounds ON bounds.trials = scores.trials
+                WHERE scores.run_id = :run AND (bounds.low IS NULL OR scores.score BETWEEN bounds.low AND bounds.high)
+            ),
+            stats AS (
+                SELECT trials, COUNT(*) AS n, AVG(score) AS mean,
+                    (SUM(score * score) - SUM(score) * SUM(score) * 1.0 / COUNT(*)) / (COUNT(*) - 1) AS variance
+                FROM kept GROUP BY trials
+            )
+            SELECT trials, n, mean, variance,
+                mean - t_ppf(:confidence, n - 1) * sqrt(variance / n) AS low,
+                mean + t_ppf(:confidence, n - 1) * sqrt(variance / n) AS high
+            FROM stats ORDER BY trials""", {'run': run, 'confidence': confidence}).fetchall()
+
+    def compareRuns(self, run, other, confidence=.95):
+        """
+        Compares the mean scores of the trial counts two runs have in common
+
+        returns a list of sqlite3.Row of trials, mean, other_mean, difference,
+        and overlap (1 if the confidence intervals overlap), by trial count
+        """
+        return self.connection.execute(f"""
+            WITH first AS ({STATISTICS.replace(':run', ':first')}),
+            second AS ({STATISTICS.replace(':run', ':second')})
+            SELECT first.trials, first.mean, second.mean AS other_mean, second.mean - first.mean AS difference,
+                first.low <= second.high AND second.low <= first.high AS overlap
+            FROM first JOIN second ON first.trials = second.trials ORDER BY first.trials""",
+            {'first': run, 'second': other, 'confidence': confidence}).fetchall()
+
+    def importTrainFile(self, file_name, game="qsnake.QGame"):
+        """Adds every training of a file written by qsnake.train() as a run, see importTrainFile()"""
+        return importTrainFile(self, file_name, game)
+
+
+class ScoreArchive():
+    """
+    Training results stored column by column in a directory of .npy files,
+    for analysis of many runs without parsing anything:
+
+    scores.npy - the final scores of every replication of every run, one after the other
+    index.npy - (run, trials, start, stop) of every trial count of every run, its scores
+        are scores[start:stop]
+    runs.json - the game, seed, replications and settings of every run
+
+    The scores are memory mapped, so opening an archive is instant and the
+    scores of a trial count are read without copying them. New runs are kept
+    in memory until save() (or close()).
+
+    Public Methods:
+    addRun(game, seed, replications, config)
+    addScores(run, trials, scores)
+    runs(game)
+    latestRun(game)
+    config(run)
+    scores(run, trials)
+    trialScores(run)
+    importTrainFile(file_name, game)
+    save()
+    close()
+    """
+
+    INDEX = np.dtype([('run', '<i8'), ('trials', '<i8'), ('start', '<i8'), ('stop', '<i8')])
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta = []
+        self.index = np.zeros(0, dtype=self.INDEX)
+        self.all_scores = np.zeros(0, dtype=np.int32)
+        if os.path.exists(self.path("runs.json")):
+            with open(self.path("runs.json")) as in_file:
+                self.meta = json.load(in_file)
+            self.index = np.load(self.path("index.npy"))
+            self.all_scores = np.load(self.path("scores.npy"), mmap_mode='r')
+        self.pending = []
+        self.changed = False # Only written back if runs were added, readers mustn't overwrite other writers
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def close(self):
+        self.save()
+
+    def addRun(self, game, seed, replications, config=None):
+        """
+        Adds a run without scores
+
+        Arguments:
+        game - name of the game type, like "qsnake.QGame"
+        seed - root seed of the sweep
+        replications - replications of every trial count
+        config - dictionary of the other settings, they must be JSON serializable
+
+        returns the id of the run
+        """
+        run = len(self.meta) + 1
+        self.meta.append({'id': run, 'created': time.strftime("%Y-%m-%dT%H:%M:%S"), 'game': game,
+            'seed': None if seed is None else str(seed), 'replications': replications, 'config': config or {}})
+        self.changed = True
+        return run
+
+    def addScores(self, run, trials, scores):
+        """
+        Adds the final scores of the replications of a trial count
+
+        Arguments:
+        run - id of the run
+        trials - the trial count
+        scores - list of final scores, one per replication
+        """
+        self.pending.append((run, trials, np.asarray(scores, dtype=np.int32)))
+        self.changed = True
+
+    def save(self):
+        """Writes the runs added since the archive was opened or last saved, nothing if there are none"""
+        if not self.changed:
+            return
+        if self.pending:
+            start = len(self.all_scores)
+            rows = []
+            for run, trials, scores in self.pending:
+                rows.append((run, trials, start, start + len(scores)))
+                start += len(scores)
+            all_scores = np.concatenate([self.all_scores] + [scores for _, _, scores in self.pending])
+            self.index = np.concatenate([self.index, np.array(rows, dtype=self.INDEX)])
+            # Written next to the files and moved over them, the old scores may still be mapped
+            np.save(self.path("scores.tmp.npy"), all_scores)
+            np.save(self.path("index.tmp.npy"), self.index)
+            os.replace(self.path("scores.tmp.npy"), self.path("scores.npy"))
+            os.replace(self.path("index.tmp.npy"), self.path("index.npy"))
+            self.all_scores = np.load(self.path("scores.npy"), mmap_mode='r')
+            self.pending = []
+
+        with open(self.path("runs.tmp.json"), "w") as out_file:
+            json.dump(self.meta, out_file, indent=4)
+        os.replace(self.path("runs.tmp.json"), self.path("runs.json"))
+        self.changed = False
+
+    def runs(self, game=None):
+        """
+        Returns the runs, oldest first, as a list of dictionaries of id, created,
+        game, seed, replications and the number of trial counts
+        """
+        return [dict(run, trial_counts=len(np.unique(self.index['trials'][self.index['run'] == run['id']])))
+            for run in self.meta if game is None or run['game'] == game]
+
+    def latestRun(self, game=None):
+        """Returns the id of the newest run (of the game), None if there isn't one"""
+        runs = [run['id'] for run in self.meta if game is None or run['game'] == game]
+        return max(runs) if runs else None
+
+    def config(self, run):
+        """Returns the settings of a run as a dictionary, empty if there is no such run"""
+        return next((meta['config'] for meta in self.meta if meta['id'] == run), {})
+
+    def scores(self, run, trials):
+        """
+        Returns the final scores of a trial count of a run as an array. Unless the
+        run played the trial count more than once, it is a view of the memory
+        mapped file.
+        """
+        rows = self.index[(self.index['run'] == run) & (self.index['trials'] == trials)]
+        if len(rows) == 1:
+            return self.all_scores[rows[0]['start']:rows[0]['stop']]
+        return np.concatenate([self.all_scores[row['start']:row['stop']] for row in rows]) if len(rows) \
+            else np.zeros(0, dtype=np.int32)
+
+    def trialScores(self, run):
+        """Returns a dictionary of every trial count of a run to its scores (see scores()), by trial count"""
+        return {int(trials): self.scores(run, trials)
+            for trials in np.unique(self.index['trials'][self.index['run'] == run])}
+
+    def importTrainFile(self, file_name, game="qsnake.QGame"):
+        """Adds every training of a file written by qsnake.train() as a run, see importTrainFile()"""
+        runs = importTrainFile(self, file_name, game)
+        self.save()
+        return runs
+
+
+def importTrainFile(results, file_name, game="qsnake.QGame"):
+    """
+    Adds every training of a file written by qsnake.train(out_file_name=...) as a run
+
+    Arguments:
+    results - the ResultsStore or ScoreArchive to add to
+    file_name - the file, like train_file.txt
+    game - name of the game type the file was trained on
+
+    returns the ids of the new runs
+    """
+    runs = []
+    for records in readTrainFile(file_name):
+        run = results.addRun(game, records[0].get('seed'), records[0]['replications'],
+            {'source': file_name, 'trial_set': [record['trials'] for record in records]})
+        for record in records:
+            results.addScores(run, record['trials'], [int(score) for score in record['final_scores'].split()])
+        runs.append(run)
+    return runs
+
+
+def readTrainFile(file_name):
+    """
+    Reads every training of a file written by qsnake.train(out_file_name=...)
+
+    returns a list of the list of records of every training
+    """
+    with open(file_name) as in_file:
+        lines = in_file.readlines()[1:] # The first line is the count
+
+    trainings = []
+    block = []
+    for line in lines:
+        if line.startswith("Training: "):
+            if block:
+                trainings.append(json.loads("".join(block)))
+            block = []
+        else:
+            block.append(line)
+    if block:
+        trainings.append(json.loads("".join(block)))
+    return trainings
+
+
+def parseArgs():
+    """
+    Parses the command line arguments.
+
+    Returns them as a Namespace object
+    """
+    parser = argparse.ArgumentParser(description="Store training results in SQLite or .npy columns.")
+    parser.add_argument('command', choices=["import", "runs"])
+    parser.add_argument('file_name', nargs='?', help="File written by qsnake.train() to import")
+    parser.add_argument('-database', '-db', default="results.db")
+    parser.add_argument('-archive', '-a', help="Directory of a ScoreArchive to use instead of the database")
+    parser.add_argument('-game', '-g', default="qsnake.QGame", help="Game the imported file was trained on")
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    store = ScoreArchive(args.archive) if args.archive else ResultsStore(args.database)
+    if args.command == "import":
+        runs = store.importTrainFile(args.file_name, args.game)
+        print(f"Imported {len(runs)} runs from {args.file_name} into {args.archive or args.database}")
+    for run in store.runs():
+        print(f"Run: {run['id']}; Created: {run['created']}; Game: {run['game']}; "
+            f"Replications: {run['replications']}; Trial counts: {run['trial_counts']}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#! /usr/bin/env python3
+"""
+Live telemetry of qsnake.train() sweeps.
+
+Every worker of the pool has a WorkerMonitor that counts the steps, episodes
+and scores of the games it plays and, at most once a second, puts them on a
+queue. A TelemetryListener in the parent takes them off the queue and keeps
+a refreshed line on the console and, optionally, a JSON metrics file with the
+totals and the latest counters of every worker. Workers that haven't reported
+for a while are shown as stalled. A MetricsServer serves the same metrics to
+Prometheus over HTTP, on localhost only.
+
+Usage:
+    qsnake.train(..., live=True, metrics_file="metrics.json", metrics_port=9100)
+    curl http://127.0.0.1:9100/metrics
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class WorkerMonitor():
+    """
+    Counts what a worker plays and sends it to the parent
+
+    Public Methods:
+    beginTask(trials, replications)
+    episode(trial)
+    push()
+
+    Instance Variables:
+    episodes - number of games finished by the worker
+    scores - scores of the last games, for the rolling score
+    finished - dictionary of trial count to [replications finished, sum of their final scores]
+    """
+
+    def __init__(self, queue, game, interval=1, window=20):
+        """
+        Arguments:
+        queue - multiprocessing.Queue read by a TelemetryListener
+        game - the QGame the worker plays
+        interval - least number of seconds between two messages
+        window - number of games in the rolling score
+        """
+        self.queue = queue
+        self.game = game
+        self.interval = interval
+        self.pid = os.getpid()
+        self.start_moves = game.snake.moves
+        self.episodes = 0
+        self.scores = deque(maxlen=window)
+        self.finished = {}
+        self.trials = 0
+        self.trial = 0
+        self.replications = 0
+        self.last_push = 0
+        self.push()
+
+    def beginTask(self, trials, replications):
+        """Starts counting a new task of the pool"""
+        self.trials = trials
+        self.replications = replications
+        self.trial = 0
+
+    def episode(self, trial):
+        """
+        Counts a finished game, sending the counters if the last message is old enough
+
+        Arguments:
+        trial - index of the trial of the replication, trials for the scored game
+        """
+        self.episodes += 1
+        self.trial = trial
+        self.scores.append(self.game.score)
+        if trial == self.trials: # The scored game at the end of a replication
+            finished = self.finished.setdefault(self.trials, [0, 0])
+            finished[0] += 1
+            finished[1] += self.game.score
+        if time.monotonic() - self.last_push >= self.interval:
+            self.push()
+
+    def push(self):
+        """Sends the counters to the parent"""
+        self.last_push = time.monotonic()
+        self.queue.put({
+            'pid': self.pid,
+            'time': time.time(),
+            'steps': self.game.snake.moves - self.start_moves,
+            'episodes': self.episodes,
+            'trials': self.trials,
+            'trial': self.trial,
+            'replications': self.replications,
+            'rolling_score': sum(self.scores) / len(self.scores) if self.scores else 0.0,
+            'states': len(self.game.qTable),
+            'finished': {trials: list(finished) for trials, finished in self.finished.items()}
+        })
+
+
+class TelemetryListener():
+    """
+    Collects the messages of the WorkerMonitors in a thread of the parent
+
+    Public Methods:
+    start()
+    stop()
+    summary()
+
+    Instance Variables:
+    workers - dictionary of pid to the latest message of the worker
+    latest - the last summary(), None until the first refresh
+    """
+
+    def __init__(self, queue, refresh=1, metrics_file=None, console=True, stall=30, sweep=None):
+        """
+        Arguments:
+        queue - multiprocessing.Queue the workers send to
+        refresh - seconds between two updates of the console line and metrics file
+        metrics_file - JSON file to keep the metrics in, none by default
+        console - keep a line with the metrics on the console
+        stall - seconds without a message after which a worker counts as stalled
+        sweep - dictionary of trial count to the number of replications the sweep plays of it
+        """
+        self.queue = queue
+        self.refresh = refresh
+        self.metrics_file = metrics_file
+        self.console = console
+        self.stall = stall
+        self.sweep = sweep if sweep is not None else {}
+        self.workers = {}
+        self.latest = None
+        self.lock = threading.Lock() # The workers are read by the MetricsServer's threads
+        self.thread = None
+
+    def start(self):
+        """Starts listening in a background thread"""
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.last_steps = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Reads what is left on the queue and stops the thread, once the workers are done"""
+        self.queue.put(None)
+        self.thread.join()
+        self.update()
+        if self.console:
+            print(file=sys.stderr)
+
+    def run(self):
+        """Body of the thread: takes messages off the queue until stop() is called"""
+        last_update = time.monotonic()
+        while True:
+            try:
+                message = self.queue.get(timeout=self.refresh)
+            except queue.Empty:
+                message = {}
+            if message is None:
+                return
+            if message:
+                with self.lock:
+                    self.workers[message['pid']] = message
+            if time.monotonic() - last_update >= self.refresh:
+                last_update = time.monotonic()
+                self.update()
+
+    def summary(self):
+        """
+        Returns the totals over the workers as a dictionary. The recent rate is
+        the one since the last summary, so only the listener's thread calls it.
+        """
+        now = time.time()
+        with self.lock:
+            workers = [dict(worker, seconds_since_report=now - worker['time']) for worker in self.workers.values()]
+        steps = sum(worker['steps'] for worker in workers)
+        episodes = sum(worker['episodes'] for worker in workers)
+
+        finished = {trials: {'replications': replications, 'finished': 0, 'score_sum': 0}
+            for trials, replications in self.sweep.items()}
+        for worker in workers:
+            for trials, (count, score_sum) in worker['finished'].items():
+                totals = finished.setdefault(trials, {'replications': 0, 'finished': 0, 'score_sum': 0})
+                totals['finished'] += count
+                totals['score_sum'] += score_sum
+        for totals in finished.values():
+            totals['mean_final_score'] = totals['score_sum'] / totals['finished'] if totals['finished'] else 0.0
+        done = sum(totals['finished'] for totals in finished.values())
+
+        elapsed = max(now - self.start_time, 1e-9)
+        recent = (steps - self.last_steps) / max(now - self.last_time, 1e-9)
+        self.last_time, self.last_steps = now, steps
+        return {
+            'elapsed_seconds': elapsed,
+            'workers': len(workers),
+            'steps': steps,
+            'episodes': episodes,
+            'steps_per_second': steps / elapsed,
+            'recent_steps_per_second': recent,
+            'episodes_per_second': episodes / elapsed,
+            'rolling_score': sum(worker['rolling_score'] for worker in workers) / len(workers) if workers else 0.0,
+            'mean_final_score': sum(totals['score_sum'] for totals in finished.values()) / done if done else 0.0,
+            'trial_counts': finished,
+            'stalled': [worker['pid'] for worker in workers if worker['seconds_since_report'] > self.stall],
+            'worker_counters': workers
+        }
+
+    def update(self):
+        """Refreshes the console line and the metrics file"""
+        summary = self.summary()
+        self.latest = summary
+        if self.console:
+            stalled = f"; STALLED: {', '.join(map(str, summary['stalled']))}" if summary['stalled'] else ""
+            sys.stderr.write(f"\rWorkers: {summary['workers']}; Steps: {summary['steps']} "
+                f"({summary['recent_steps_per_second']:.0f}/s); Games: {summary['episodes']} "
+                f"({summary['episodes_per_second']:.1f}/s); Rolling score: {summary['rolling_score']:.2f}{stalled}  ")
+            sys.stderr.flush()
+        if self.metrics_file:
+            # Written next to the file and moved over it, so readers never see half of it
+            temporary = self.metrics_file + ".tmp"
+            with open(temporary, "w") as out_file:
+                json.dump(summary, out_file, indent=4)
+            os.replace(temporary, self.metrics_file)
+
+
+def prometheusMetrics(summary):
+    """
+    Formats a TelemetryListener.summary() in the Prometheus text format
+
+    returns the text as a string
+    """
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append(f"# HELP snake_train_{name} {help}")
+        lines.append(f"# TYPE snake_train_{name} {kind}")
+        for labels, value in samples:
+            label_text = "{" + ",".join(f'{key}="{label}"' for key, label in labels.items()) + "}" if labels else ""
+            lines.append(f"snake_train_{name}{label_text} {value}")
+
+    metric("elapsed_seconds", "gauge", "Seconds since the sweep started", [({}, summary['elapsed_seconds'])])
+    metric("steps_total", "counter", "Steps played by every worker", [({}, summary['steps'])])
+    metric("episodes_total", "counter", "Games finished by every worker", [({}, summary['episodes'])])
+    metric("steps_per_second", "gauge", "Steps per second since the last refresh",
+        [({}, summary['recent_steps_per_second'])])
+    metric("episodes_per_second", "gauge", "Games per second since the sweep started",
+        [({}, summary['episodes_per_second'])])
+    metric("mean_final_score", "gauge", "Mean score of the scored games of every finished replication",
+        [({}, summary['mean_final_score'])])
+
+    trial_counts = sorted(summary['trial_counts'].items())
+    metric("replications", "gauge", "Replications the sweep plays of every trial count",
+        [({'trials': trials}, totals['replications']) for trials, totals in trial_counts])
+    metric("replications_finished", "gauge", "Finished replications of every trial count",
+        [({'trials': trials}, totals['finished']) for trials, totals in trial_counts])
+    metric("trial_mean_final_score", "gauge", "Mean final score of the finished replications of every trial count",
+        [({'trials': trials}, totals['mean_final_score']) for trials, totals in trial_counts])
+
+    workers = summary['worker_counters']
+    stalled = set(summary['stalled'])
+    metric("worker_up", "gauge", "1 if the worker reported recently, 0 if it stalled",
+        [({'pid': worker['pid']}, int(worker['pid'] not in stalled)) for worker in workers])
+    metric("worker_seconds_since_report", "gauge", "Seconds since the worker last reported",
+        [({'pid': worker['pid']}, worker['seconds_since_report']) for worker in workers])
+    metric("worker_steps_total", "counter", "Steps played by the worker",
+        [({'pid': worker['pid']}, worker['steps']) for worker in workers])
+    metric("worker_qtable_states", "gauge", "States in the QTable the worker is training",
+        [({'pid': worker['pid']}, worker['states']) for worker in workers])
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer():
+    """
+    Serves the metrics of a TelemetryListener at http://127.0.0.1:<port>/metrics
+    from a background thread. The metrics are those of the listener's last
+    refresh, 503 Service Unavailable is returned before the first one.
+
+    Public Methods:
+    start()
+    stop()
+    """
+
+    def __init__(self, listener, port=9100, host="127.0.0.1"):
+        """
+        Arguments:
+        listener - the TelemetryListener to serve the metrics of
+        port - port to listen on, 0 picks a free one (see port after start())
+        host - address to bind to, localhost so the metrics aren't public
+        """
+        self.listener = listener
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        """
+        Starts serving and writes where to the console (stderr, like the
+        listener's line), the port is only known here when 0 was asked for
+        """
+        listener = self.listener
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                # Only the listener's thread computes summaries, they update the recent rate
+                latest = listener.latest
+                if latest is None:
+                    self.send_error(503, "No metrics before the first refresh")
+                    return
+                body = prometheusMetrics(latest).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Scrapes would write over the console line
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Serving metrics at http://{self.host}:{self.port}/metrics", file=sys.stderr)
+
+    def stop(self):
+        """Stops serving and closes the socket"""
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+"""
+Tests of the state encoders of qsnake.
+
+Run with:
+    python -m pytest test_encoders.py
+"""
+import os
+import random
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+
+import constant
+import qcomplex_snake
+import qsnake
+import snake
+
+
+def classicEncoding(snake_obj, food):
+    """
+    The encoding of the original QTable.encodeState(): the walls and every
+    piece of the tail but its end are compared against the eight cells around
+    the head, one by one.
+
+    returns the encoded state as a string of 12 bits
+    """
+    game = snake_obj.game
+    size = snake_obj.width
+    neighbours = [(x, y) for x in range(snake_obj.x - size, snake_obj.x + size * 2, size)
+        for y in range(snake_obj.y - size, snake_obj.y + size * 2, size)
+        if (x, y) != (snake_obj.x, snake_obj.y)]
+    bits = 0
+    for bit, (x, y) in enumerate(neighbours):
+        if (x < game.leftBoundry or y < 0 or x == game.rightBoundry or y == constant.WINDOW_HEIGHT
+            or any(block.colliderect(snake.Block(constant.BLOCK_SIZE, x, y)) for block in snake_obj.tail[1:])):
+            bits |= 1 << bit
+
+    if food.x > snake_obj.x and food.y <= snake_obj.y:
+        quadrant = 0
+    elif food.x <= snake_obj.x and food.y < snake_obj.y:
+        quadrant = 1
+    elif food.x < snake_obj.x and food.y >= snake_obj.y:
+        quadrant = 2
+    else:
+        quadrant = 3
+    direction = ["UP", "LEFT", "DOWN", "RIGHT"].index(snake_obj.getDirection().name)
+    return format(bits | quadrant << 8 | direction << 10, "012b")
+
+
+def testObstacleSetsNeighbourBit():
+    """A redirection block on any of the eight cells around the head sets the bit of that cell"""
+    start = qcomplex_snake.QGame(training=True, layout=[])
+    column, row = start.cellOf(start.snake.x, start.snake.y)
+    for bit, (dx, dy) in enumerate(qsnake.NeighbourEncoder.NEIGHBOURS):
+        game = qcomplex_snake.QGame(training=True, layout=[(column + dx, row + dy)])
+        assert game.isBlocked(game.snake.x + dx * game.size, game.snake.y + dy * game.size)
+        assert game.qTable.encoder.surroundingBits(game.snake) == 1 << bit
+
+
+def testNeighbourEncoderMatchesClassic():
+    """Without redirection blocks the encoder gives the original encoding, walls and tail included"""
+    rng = random.Random(0)
+    game = qsnake.QGame(training=True, seed=0)
+    encoder = qsnake.NeighbourEncoder(game)
+    longest = 0
+    for move in range(3000):
+        if game.done:
+            game.restart()
+        directions = game.snake.safeDirections() or list(snake.Snake.MOVES)
+        direction = rng.choice(directions)
+        if move % 3 == 0: # Put the food in the way, so the tail grows
+            column, row = game.cellOf(game.snake.x, game.snake.y)
+            column, row = column + direction.value[0], row + direction.value[1]
+            if 0 <= column < game.gridWidth and 0 <= row < game.gridHeight and game.food.x >= 0:
+                game.food.moveTo(game.leftBoundry + column * game.size, row * game.size)
+        game.snake.changeDirection(direction)
+        game.snake.move()
+        if not game.done:
+            assert encoder.encode(game.snake, game.food) == classicEncoding(game.snake, game.food)
+            longest = max(longest, len(game.snake.tail))
+    assert longest > 10